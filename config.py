@@ -33,3 +33,66 @@ SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET", "")
 # get from https://developer.spotify.com/dashboard/
 
 SERVER_TZ = ZoneInfo(os.getenv("SERVER_TZ", "UTC"))
+
+STAT_FLUSH_INTERVAL = int(os.getenv("STAT_FLUSH_INTERVAL", 30))
+# the seconds between two writes of the buffered user stats (messages, commands) to the database
+STAT_BUFFER_SIZE = int(os.getenv("STAT_BUFFER_SIZE", 5000))
+# the amount of distinct user stat rows held in memory before they are written to the database early
+
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 10))
+# the maximum amount of webhooks the news are sent to at the same time
+
+FEED_PARSER_POOL = os.getenv("FEED_PARSER_POOL", "thread")
+# where the news feed is parsed, off the event loop. "thread" or "process"; a process pool also frees the GIL
+FEED_PARSER_WORKERS = int(os.getenv("FEED_PARSER_WORKERS", 2))
+# the amount of workers in the feed parser pool
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+# the journal mode of both sqlite databases. WAL lets readers and a writer work at the same time
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# how often sqlite syncs to disk. NORMAL is safe with WAL and only loses the last transactions on a power loss
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", -20000))
+# the page cache per connection. negative values are KiB, positive values are pages
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 268435456))
+# the bytes of the database file that are memory mapped. 0 disables memory mapping
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+# where temporary tables and indices are kept. DEFAULT, FILE or MEMORY
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))
+# the milliseconds a connection waits for a lock before it fails with "database is locked"
+SQLITE_OPTIMIZE_INTERVAL = int(os.getenv("SQLITE_OPTIMIZE_INTERVAL", 6))
+# the hours between two runs of PRAGMA optimize and a WAL checkpoint on both sqlite databases
+
+USERSTATS_DAY_HORIZON = int(os.getenv("USERSTATS_DAY_HORIZON", 35))
+# the days user stats are kept per day. older days are rolled up into weeks
+USERSTATS_WEEK_HORIZON = int(os.getenv("USERSTATS_WEEK_HORIZON", 26))
+# the weeks user stats are kept per week. older weeks are rolled up into months
+USERSTATS_MONTH_HORIZON = int(os.getenv("USERSTATS_MONTH_HORIZON", 24))
+# the months user stats are kept per month. older months are rolled up into one all time row
+USERSTATS_COMPACT_INTERVAL = int(os.getenv("USERSTATS_COMPACT_INTERVAL", 24))
+# the hours between two compactions of the user stats
+
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 10))
+# the amount of users shown on the leaderboards of a guild
+LEADERBOARD_PERSIST_INTERVAL = int(os.getenv("LEADERBOARD_PERSIST_INTERVAL", 5))
+# the minutes between two writes of the leaderboards to the database
+
+URL_CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", 10000))
+# the amount of url verdicts of the safe browsing api kept in memory
+URL_CACHE_SAFE_TTL = int(os.getenv("URL_CACHE_SAFE_TTL", 1800))
+# the seconds a url the safe browsing api didn't match is considered safe without asking again
+URL_CACHE_UNSAFE_TTL = int(os.getenv("URL_CACHE_UNSAFE_TTL", 86400))
+# the seconds a url the safe browsing api matched is considered malicious without asking again
+URL_CACHE_PERSIST = os.getenv("URL_CACHE_PERSIST", "true").lower() == "true"
+# whether the url verdicts are stored in the short term storage, so a restart keeps them
+
+SAFE_BROWSING_URL = os.getenv("SAFE_BROWSING_URL", "https://safebrowsing.googleapis.com/v4")
+# the base url of the safe browsing api. can point to a local fixture server for testing
+SAFE_BROWSING_LOCAL = os.getenv("SAFE_BROWSING_LOCAL", "true").lower() == "true"
+# whether urls are matched against a local copy of the threat lists (update api) instead of asking for every url
+SAFE_BROWSING_UPDATE_INTERVAL = int(os.getenv("SAFE_BROWSING_UPDATE_INTERVAL", 30))
+# the minutes between two updates of the local threat lists. the api can ask to wait longer
+
+URL_BATCH_WINDOW = float(os.getenv("URL_BATCH_WINDOW", 0.25))
+# the seconds urls of all messages are collected before they are checked together
+URL_BATCH_SIZE = int(os.getenv("URL_BATCH_SIZE", 500))
+# the maximum amount of urls checked together, a full batch is checked right away. the api accepts up to 500
@@ -80,6 +80,7 @@ class SettingsCog(commands.Cog):
         db_setting = SettingsEnum(setting)
         if value == "❌ Remove Setting ❌":
             await self.client.db.delete_setting(db_setting, ctx.guild)
+            self.client.dispatch("setting_update", db_setting, ctx.guild)
             return await ctx.response.send_message(
                 embed=discord.Embed(
                     title="Success",
@@ -93,6 +94,7 @@ class SettingsCog(commands.Cog):
         else:
             settings_value = discord.utils.find(lambda c: c.name == value, ctx.guild.channels)
         await self.client.db.update_setting(setting=db_setting, value=settings_value.id, guild=ctx.guild)
+        self.client.dispatch("setting_update", db_setting, ctx.guild)
 
         await ctx.response.send_message(
             embed=discord.Embed(
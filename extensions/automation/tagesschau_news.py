@@ -1,4 +1,8 @@
+import asyncio
+import hashlib
 import html
+import re
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import aiohttp
@@ -7,9 +11,29 @@ import feedparser
 from bs4 import BeautifulSoup
 from discord.ext import commands, tasks
 
+from config import FEED_PARSER_POOL, FEED_PARSER_WORKERS
 from utils import Bot, CustomLogger, WebhookType
 
 regex = r"https://images\.tagesschau\.de/image/(?:[A-Za-z0-9_-]+/)+[A-Za-z0-9_-]+\.jpg(?:\?width=\d+)?"
+IMG_SRC = re.compile(r"""<img\b[^>]*?\bsrc\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+
+
+def parse_feed(data: bytes) -> list[dict]:
+    """Parses the raw feed. Runs in the parser pool"""
+    return feedparser.parse(data)["entries"]
+
+
+def extract_image(html_content: str) -> str | None:
+    """Returns the src of the first img tag. Only builds a soup if the tag can't be matched directly"""
+    if "<img" not in html_content.lower():
+        return None
+    match = IMG_SRC.search(html_content)
+    if match:
+        return match.group(1)
+    img_tag = BeautifulSoup(html_content, "html.parser").find("img")
+    if img_tag and img_tag.has_attr("src"):
+        return img_tag["src"]
+    return None
 
 
 def parse_tagesschau_feed(entry: dict) -> dict:
@@ -30,11 +54,7 @@ def parse_tagesschau_feed(entry: dict) -> dict:
     html_content = html.unescape(html_content)
 
     # Bild-URL extrahieren
-    image = None
-    soup = BeautifulSoup(html_content, "html.parser")
-    img_tag = soup.find("img")
-    if img_tag and img_tag.has_attr("src"):
-        image = img_tag["src"]
+    image = extract_image(html_content)
 
     return {
         "title": entry["title_detail"]["value"],
@@ -47,92 +67,119 @@ def parse_tagesschau_feed(entry: dict) -> dict:
     }
 
 
+def news_embed(ent: dict) -> discord.Embed:
+    """Builds the embed sent to the guilds from a parsed feed entry"""
+    return discord.Embed(
+        title=ent["title"],
+        url=ent["link"],
+        description=ent["summary"]
+        + f"\n\nPublished: {discord.utils.format_dt(ent['published'])}"
+        + f"\n Updated: {discord.utils.format_dt(ent['updated'])}",
+        image=discord.EmbedMedia(ent["image"]),
+        color=discord.Color.from_rgb(60, 87, 141),
+        footer=discord.EmbedFooter(
+            text="Distributed in compliance with the Creative Commons license\n(CC BY-SA)",
+            icon_url="https://raw.githubusercontent.com/github/explore/"
+            "48db34428146b2d62f0b7079fa6c12c711e2322f/topics/creative-commons/creative-commons.png",
+        ),
+        author=discord.EmbedAuthor(
+            name="Source: Tagesschau.de",
+            url="https://www.tagesschau.de",
+            icon_url="https://www.ard.de/static/media/appIcon.ts.b846aebc4c4b299d0fbd.jpg",
+        ),
+    )
+
+
+def entry_hash(entry: dict) -> str:
+    """Hashes the fields of a raw feed entry that end up in the embed"""
+    fields = (entry.get("id"), entry.get("updated"), entry.get("title"), entry.get("summary"), entry.get("link"))
+    return hashlib.sha1(repr(fields).encode()).hexdigest()
+
+
 class TagesschauFeed(commands.Cog):
     def __init__(self, client):
         self.client: Bot = client
         self.logger = CustomLogger(self.qualified_name, self.client.boot_time)
         self.url = "https://www.tagesschau.de/infoservices/alle-meldungen-100~rss2.xml"
         self.session: aiohttp.ClientSession = None  # type: ignore
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.feed_hash: str | None = None
+        self.entry_hashes: dict[str, str] = {}  # entry id -> hash of the entry when it was last processed
+        self.executor: Executor = None  # type: ignore
+
+    def cog_unload(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def parse_entry(self, index: int, entry: dict) -> tuple[int, dict]:
+        """Parses a feed entry in the parser pool and returns it with its position in the feed"""
+        loop = asyncio.get_running_loop()
+        return index, await loop.run_in_executor(self.executor, parse_tagesschau_feed, entry)
 
     @tasks.loop(seconds=90)
     async def gather_news(self):
         """fetches news from tagesschau.de, parses them and checks for already sent news"""
         await self.client.wait_until_ready()
-        request = await self.session.get(self.url)
-        data = await request.text()
-        news = feedparser.parse(data)
-        if request.status == 200:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        async with self.session.get(self.url, headers=headers) as request:
+            if request.status == 304:
+                self.logger.debug(f"Requested {self.url}; {request.status} nothing changed")
+                return
+            if request.status != 200:
+                self.logger.critical(f"Requested {self.url}; {request.status}")
+                return
             self.logger.debug(f"Requested {self.url}; {request.status}")
-        else:
-            self.logger.critical(f"Requested {self.url}; {request.status}")
+            etag = request.headers.get("ETag")
+            last_modified = request.headers.get("Last-Modified")
+            data = await request.read()
+        feed_hash = hashlib.sha1(data).hexdigest()
+        if feed_hash == self.feed_hash:
+            return  # the server doesn't support conditional requests, but the feed is the same
+        entries = await asyncio.get_running_loop().run_in_executor(self.executor, parse_feed, data)
+        entry_hashes = {}
+        changed = []
+        for index, entry in enumerate(entries):
+            entry_id = entry["id"][-36:]
+            entry_hashes[entry_id] = entry_hash(entry)
+            if self.entry_hashes.get(entry_id) == entry_hashes[entry_id]:
+                continue  # unchanged since the last request, it was already handled
+            changed.append((entry_id, (index, entry)))
+        known = await self.client.sts.get_tagesschau_ids([entry_id for entry_id, _ in changed])
         new = []
-        for entry in news["entries"]:
-            ent = parse_tagesschau_feed(entry)
-            resp = await self.client.sts.get_tagesschau_id(ent["id"])
-            em = None
-            if resp is not None:  # if the post id is in the database
-                if resp["updated"] == ent["updated"]:
-                    pass
-                else:
-                    em = discord.Embed(
-                        title=ent["title"],
-                        url=ent["link"],
-                        description=ent["summary"]
-                        + f"\n\nPublished: {discord.utils.format_dt(ent['published'])}"
-                        + f"\n Updated: {discord.utils.format_dt(ent['updated'])}",
-                        image=discord.EmbedMedia(ent["image"]),
-                        color=discord.Color.from_rgb(60, 87, 141),
-                        footer=discord.EmbedFooter(
-                            text="Distributed in compliance with the Creative Commons license\n(CC BY-SA)",
-                            icon_url="https://raw.githubusercontent.com/github/explore/"
-                            "48db34428146b2d62f0b7079fa6c12c711e2322f/topics/creative-commons/"
-                            "creative-commons.png",
-                        ),
-                        author=discord.EmbedAuthor(
-                            name="Source: Tagesschau.de",
-                            url="https://www.tagesschau.de",
-                            icon_url="https://www.ard.de/static/media/appIcon.ts.b846aebc4c4b299d0fbd.jpg",
-                        ),
-                    )
-                    await self.client.sts.delete_tagesschau_id(ent["id"])
-                    await self.client.sts.enter_tagesschau_id(
-                        uuid=ent["id"], updated=ent["updated"], expires=datetime.now() + timedelta(5)
-                    )
-            else:
-                em = discord.Embed(
-                    title=ent["title"],
-                    url=ent["link"],
-                    description=ent["summary"]
-                    + f"\n\nPublished: {discord.utils.format_dt(ent['published'])}"
-                    + f"\n Updated: {discord.utils.format_dt(ent['updated'])}",
-                    image=discord.EmbedMedia(ent["image"]),
-                    color=discord.Color.from_rgb(60, 87, 141),
-                    footer=discord.EmbedFooter(
-                        text="Distributed in compliance with the Creative Commons license\n(CC BY-SA)",
-                        icon_url="https://raw.githubusercontent.com/github/explore/"
-                        "48db34428146b2d62f0b7079fa6c12c711e2322f/topics/creative-commons/creative-commons.png",
-                    ),
-                    author=discord.EmbedAuthor(
-                        name="Source: Tagesschau.de",
-                        url="https://www.tagesschau.de",
-                        icon_url="https://www.ard.de/static/media/appIcon.ts.b846aebc4c4b299d0fbd.jpg",
-                    ),
-                )
-                await self.client.sts.enter_tagesschau_id(
-                    uuid=ent["id"], updated=ent["updated"], expires=datetime.now() + timedelta(5)
-                )
-            if em is None:
-                pass
-            elif "Liveblog" in em.title:
+        seen = []
+        for parsed in asyncio.as_completed([self.parse_entry(index, entry) for _, (index, entry) in changed]):
+            index, ent = await parsed  # handle the entries in the order the pool finishes them
+            resp = known.get(ent["id"])
+            if resp is not None and resp["updated"] == ent["updated"]:
+                continue  # if the post id is in the database and wasn't updated since
+            seen.append((ent["id"], ent["updated"], datetime.now() + timedelta(5)))
+            em = news_embed(ent)
+            if "Liveblog" in em.title:
                 pass
             else:
-                new.append((em, WebhookType.Tagesschau))
+                new.append((index, em))
+        await self.client.sts.enter_tagesschau_ids(seen)
+        new = [(em, WebhookType.Tagesschau) for _, em in sorted(new, key=lambda item: item[0])]  # feed order
+        # only remember the feed once it was handled completely, a failed tick is retried with the next request
+        self.entry_hashes = entry_hashes
+        self.feed_hash = feed_hash
+        self.etag = etag
+        self.last_modified = last_modified
         self.logger.debug(f"Sent {len(new)} entries to `on_webhook_entry`")
         self.client.dispatch("webhook_entry", new)  # rest is handled by /extensions/internal/webhooks.py
 
     @commands.Cog.listener("on_start_done")
     async def on_start_done(self):
         self.session = aiohttp.ClientSession(headers={"User-Agent": f"Dragons BotV{self.client.client_version}"})
+        if FEED_PARSER_POOL == "process":
+            self.executor = ProcessPoolExecutor(max_workers=FEED_PARSER_WORKERS)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=FEED_PARSER_WORKERS, thread_name_prefix="feedparser")
         self.gather_news.start()
 
 
@@ -1,9 +1,13 @@
+import asyncio
+import contextlib
+import heapq
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from datetime import datetime, timedelta
 from config import SERVER_TZ
 from enum import Enum
 from utils import Event
+from utils.classes import Confirmation
 from utils import Bot, CustomLogger, sec_to_readable
 import pycord.multicog as pycog
 
@@ -19,13 +23,8 @@ async def event_choices(ctx: discord.AutocompleteContext) -> list[str]:
     """
     bot: Bot = ctx.bot
     now = datetime.now(tz=SERVER_TZ)
-    events = await bot.db.get_events()
-    filtered_events = []
-    for event in events:
-        event_time = event.time.replace(tzinfo=SERVER_TZ)
-        if event.host == ctx.interaction.user.id and event_time >= now:
-            filtered_events.append(f"{event.name} | {event.time.strftime('%H:%M %d.%m.%Y')}")
-    return filtered_events
+    events = await bot.db.get_events(host=ctx.interaction.user.id, after=now)
+    return [f"{event.name} | {event.time.strftime('%H:%M %d.%m.%Y')}" for event in events]
 
 
 REMINDER_BUTTONS = {
@@ -76,6 +75,7 @@ class InviteReminderSelectModal(discord.ui.DesignerModal):
             event_id=self.event.id, guest=interaction.user.id, confirmation=self.status, reminders=[0] + new_reminders
         )
         if status_update:
+            self.client.dispatch("event_schedule_update", self.event.id)
             await interaction.response.defer(invisible=True)
             await interaction.message.reply(
                 f"✅ Your answer **{'Accept' if self.status else 'Reject'}** was stored and the selected reminders were set.",
@@ -106,6 +106,7 @@ class ParticipationView(discord.ui.View):
                 event_id=self.event.id, guest=interaction.user.id, confirmation=status, reminders=[0]
             )
             if status_update:
+                self.client.dispatch("event_schedule_update", self.event.id)
                 await interaction.response.send_message(
                     f"✅ Your answer **{'Accept' if status else 'Reject'}** was stored"
                 )
@@ -524,6 +525,7 @@ class EventEditModal(discord.ui.DesignerModal):
             if self.event.mode != mode:
                 updated_mode = mode
         await self.client.db.update_event(id=self.event.id, name=updated_name, time=updated_time, mode=updated_mode)
+        self.client.dispatch("event_schedule_update", self.event.id)
         updated_event = await self.client.db.get_event_by_id(self.event.id)
         if updated_event is None:
             await interaction.response.send_message(
@@ -584,6 +586,7 @@ class EventDeleteModal(discord.ui.DesignerModal):
         else:
             success = await self.client.db.delete_event(self.event.id)
             if success:
+                self.client.dispatch("event_schedule_delete", self.event.id)
                 invited_user = self.event.invites
                 for user in invited_user:
                     user_obj: discord.User = await self.client.get_or_fetch_user(user)
@@ -611,6 +614,17 @@ class EventReminder(commands.Cog):
         self.client = client
         self.logger = CustomLogger(self.qualified_name, self.client.boot_time)
         self.persistent_views_added = False
+        # heap of (fire time, event id, user id, reminder, version), the next due reminder is always at index 0
+        self.reminders: list[tuple[datetime, str, int, int, int]] = []
+        self.scheduled_events: dict[str, Event] = {}
+        self.reminder_versions: dict[str, int] = {}  # heap entries with an outdated version are skipped
+        self.open_reminders: dict[str, dict[int, list[int]]] = {}  # event id -> user id -> reminders not yet sent
+        self.reminder_wakeup = asyncio.Event()
+        self.reminder_task: asyncio.Task | None = None
+
+    def cog_unload(self):
+        if self.reminder_task is not None:
+            self.reminder_task.cancel()
 
     @pycog.subcommand("event")
     @commands.slash_command(name="create", description="Create an event")
@@ -620,28 +634,29 @@ class EventReminder(commands.Cog):
 
     @commands.Cog.listener("on_start_done")
     async def start_done(self):
+        events: list[Event] = await self.client.db.get_events()
         if not self.persistent_views_added:
             now = datetime.now(tz=SERVER_TZ)
-            events: list[Event] = await self.client.db.get_events()
             for event in events:
                 event_time = event.time.replace(tzinfo=SERVER_TZ)
                 if event_time >= now:
                     self.client.add_view(ParticipationView(client=self.client, event=event))
             self.persistent_views_added = True
             self.logger.info("Persistant view for event invites added.")
-        self.reminder_loop.start()
+        confirmations = await self.client.db.get_complete_confirmations_for_events()
+        for event in events:
+            self.schedule_event(event, confirmations.get(event.id, []))
+        self.logger.info(f"Scheduled {len(self.reminders)} reminders for {len(self.scheduled_events)} events.")
+        if self.reminder_task is None:
+            self.reminder_task = asyncio.create_task(self.reminder_loop())
 
     @pycog.subcommand("event")
     @commands.slash_command(
         name="invite", description="Invite a user to an existing event", contexts={discord.InteractionContextType.guild}
     )
     async def invite(self, ctx: discord.ApplicationContext):
-        events = await self.client.db.get_events()
         now = datetime.now(tz=SERVER_TZ)
-        filtered_events = []
-        for event in events:
-            if event.time.replace(tzinfo=SERVER_TZ) > now:
-                filtered_events.append(event)
+        filtered_events = await self.client.db.get_events(after=now)
         if filtered_events == []:
             await ctx.respond("Sry there are no future events", ephemeral=True, delete_after=5)
             return
@@ -655,16 +670,13 @@ class EventReminder(commands.Cog):
         contexts={discord.InteractionContextType.guild},
     )
     async def request_invite(self, ctx: discord.ApplicationContext):
-        events = await self.client.db.get_events()
         now = datetime.now(tz=SERVER_TZ)
+        events = await self.client.db.get_events(after=now)
+        invited_to = await self.client.db.get_event_ids_for_guest(guest=ctx.interaction.user.id)
         filtered_events = []
         for event in events:
-            already_invites = await self.client.db.get_all_confirmations_for_event(event_id=event.id)
-            if ctx.interaction.user.id in already_invites and event.time.replace(tzinfo=SERVER_TZ) > now:
+            if event.id in invited_to or not event.mode == InviteMode.CLOSED.value:
                 filtered_events.append(event)
-            elif event.time.replace(tzinfo=SERVER_TZ) > now:
-                if not event.mode == InviteMode.CLOSED.value:
-                    filtered_events.append(event)
         if filtered_events == []:
             await ctx.respond("Sry there are no future events", ephemeral=True, delete_after=5)
             return
@@ -681,10 +693,10 @@ class EventReminder(commands.Cog):
     async def edit(self, ctx: discord.ApplicationContext, event: str):
         name = event.split(" | ")[0]
         time = datetime.strptime(event.split(" | ")[1], "%H:%M %d.%m.%Y").replace(tzinfo=SERVER_TZ)
-        events = await self.client.db.get_events()
+        events = await self.client.db.get_events(host=ctx.author.id, name=name)
         selected_event = None
         for event in events:
-            if event.name == name and event.time.replace(tzinfo=SERVER_TZ) == time:
+            if event.time.replace(tzinfo=SERVER_TZ) == time:
                 selected_event = event
                 break
 
@@ -706,10 +718,10 @@ class EventReminder(commands.Cog):
     async def delete(self, ctx: discord.ApplicationContext, event: str):
         name = event.split(" | ")[0]
         time = datetime.strptime(event.split(" | ")[1], "%H:%M %d.%m.%Y").replace(tzinfo=SERVER_TZ)
-        events = await self.client.db.get_events()
+        events = await self.client.db.get_events(host=ctx.author.id, name=name)
         selected_event = None
         for event in events:
-            if event.name == name and event.time.replace(tzinfo=SERVER_TZ) == time:
+            if event.time.replace(tzinfo=SERVER_TZ) == time:
                 selected_event = event
                 break
 
@@ -723,42 +735,111 @@ class EventReminder(commands.Cog):
         )
         await ctx.interaction.response.send_modal(modal)
 
-    @tasks.loop(seconds=30)
+    def schedule_event(self, event: Event, confirmations: list[Confirmation]) -> None:
+        """
+        Replaces all scheduled reminders of an event with the reminders of the given confirmations.
+        Args:
+            event: The event to schedule the reminders for.
+            confirmations: The confirmations of all guests that accepted the invitation.
+
+        Returns: None
+        """
+        version = self.reminder_versions.get(event.id, 0) + 1
+        self.reminder_versions[event.id] = version
+        self.scheduled_events[event.id] = event
+        self.open_reminders[event.id] = {}
+        event_time = event.time.replace(tzinfo=SERVER_TZ)
+        for conf in confirmations:
+            self.open_reminders[event.id][conf.guest] = list(conf.reminders)
+            for reminder in conf.reminders:
+                fire_time = event_time - timedelta(seconds=reminder)
+                heapq.heappush(self.reminders, (fire_time, event.id, conf.guest, reminder, version))
+        self.reminder_wakeup.set()  # the new reminders might be due before the one the loop is waiting for
+
+    def unschedule_event(self, event_id: str) -> None:
+        """
+        Drops all scheduled reminders of an event. Their heap entries are skipped once they are due.
+        """
+        self.reminder_versions.pop(event_id, None)
+        self.scheduled_events.pop(event_id, None)
+        self.open_reminders.pop(event_id, None)
+
+    @commands.Cog.listener("on_event_schedule_update")
+    async def on_event_schedule_update(self, event_id: str):
+        event = await self.client.db.get_event_by_id(event_id)
+        if event is None:
+            self.unschedule_event(event_id)
+            return
+        confirmations = await self.client.db.get_complete_confirmations_for_event(event_id=event_id)
+        self.schedule_event(event, confirmations)
+
+    @commands.Cog.listener("on_event_schedule_delete")
+    async def on_event_schedule_delete(self, event_id: str):
+        self.unschedule_event(event_id)
+
     async def reminder_loop(self):
-        now = datetime.now(tz=SERVER_TZ)
-        events = await self.client.db.get_events()
+        """
+        Sleeps until the next reminder is due or the schedule changed and sends all due reminders.
+        """
+        while True:
+            self.reminder_wakeup.clear()
+            if self.reminders:
+                delay = (self.reminders[0][0] - datetime.now(tz=SERVER_TZ)).total_seconds()
+                delay = min(delay, 3600)  # wake up at least hourly so a changed system clock can't delay reminders
+            else:
+                delay = None
+            if delay is None or delay > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.reminder_wakeup.wait(), timeout=delay)
+                continue
+            try:
+                await self.send_due_reminders()
+            except Exception as e:
+                self.logger.error("Sending reminders failed", exc_info=e)
 
-        for event in events:
-            event_time = event.time.replace(tzinfo=SERVER_TZ)
-            delta = (event_time - now).total_seconds()
-
-            for user_id in event.invites:
-                conf = await self.client.db.get_comfirmation_for_event_and_user(event_id=event.id, guest=user_id)
-                if conf is None:
-                    continue
-                deleted = False
-                for reminder in conf.reminders:
-                    if delta <= reminder:
-                        conf.reminders.remove(reminder)
-                        try:
-                            user = await self.client.fetch_user(user_id)
-                            em = discord.Embed(title="⏰ **Event**", color=discord.Color.brand_green())
-                            if reminder == 0:
-                                em.add_field(name="", value=f"**{event.name}** starts now!")
-                                await self.client.db.delete_event(event.id)
-                                deleted = True
-                            else:
-                                em.add_field(name="", value=f"**{event.name}** starts in {sec_to_readable(reminder)}.")
-                            await user.send(embed=em)
-                            self.logger.info(
-                                f"Reminder for {event.id} send {sec_to_readable(reminder)} minutes before the event"
-                            )
-                        except discord.Forbidden:
-                            pass
-                        if not deleted:
-                            await self.client.db.update_confirmation(
-                                event_id=event.id, guest=user_id, reminders=conf.reminders
-                            )
+    async def send_due_reminders(self):
+        now = datetime.now(tz=SERVER_TZ)
+        finished_events = set()
+        try:
+            while self.reminders and self.reminders[0][0] <= now:
+                _, event_id, user_id, reminder, version = heapq.heappop(self.reminders)
+                if self.reminder_versions.get(event_id) != version:
+                    continue  # the event was changed or deleted after this reminder was scheduled
+                event = self.scheduled_events[event_id]
+                open_reminders = self.open_reminders[event_id][user_id]
+                open_reminders.remove(reminder)
+                if reminder == 0:
+                    finished_events.add(event_id)
+                try:
+                    user = await self.client.get_or_fetch_user(user_id)
+                    em = discord.Embed(title="⏰ **Event**", color=discord.Color.brand_green())
+                    if reminder == 0:
+                        em.add_field(name="", value=f"**{event.name}** starts now!")
+                    else:
+                        em.add_field(name="", value=f"**{event.name}** starts in {sec_to_readable(reminder)}.")
+                    await user.send(embed=em)
+                    self.logger.info(
+                        f"Reminder for {event.id} send {sec_to_readable(reminder)} minutes before the event"
+                    )
+                except discord.Forbidden:
+                    pass
+                except discord.HTTPException as e:
+                    self.logger.error(f"Couldn't send the reminder for {event_id} to {user_id}", exc_info=e)
+                if reminder != 0:
+                    try:
+                        await self.client.db.update_confirmation(
+                            event_id=event_id, guest=user_id, reminders=open_reminders
+                        )
+                    except Exception as e:
+                        self.logger.error(f"Couldn't store the open reminders of {user_id} for {event_id}", exc_info=e)
+        finally:
+            # also runs if a reminder failed, events that already started are never left scheduled
+            for event_id in finished_events:
+                self.unschedule_event(event_id)
+                try:
+                    await self.client.db.delete_event(event_id)
+                except Exception as e:
+                    self.logger.error(f"Couldn't delete the finished event {event_id}", exc_info=e)
 
 
 def setup(client):
@@ -0,0 +1,52 @@
+from discord.ext import commands, tasks
+
+from config import LEADERBOARD_PERSIST_INTERVAL, SQLITE_OPTIMIZE_INTERVAL, USERSTATS_COMPACT_INTERVAL
+from utils import Bot, CustomLogger
+
+
+class DBMaintenance(commands.Cog):
+    def __init__(self, client):
+        self.client: Bot = client
+        self.logger = CustomLogger(self.qualified_name, self.client.boot_time)
+
+    @tasks.loop(hours=SQLITE_OPTIMIZE_INTERVAL)
+    async def optimize(self):
+        """Lets sqlite refresh its query planner statistics and moves the write-ahead logs back into the databases"""
+        try:
+            content = await self.client.db.optimize()
+            if content is not None:
+                self.logger.info(f"Optimized the ContentDB, checkpoint (busy, log, checkpointed): {content}")
+            sts = await self.client.sts.optimize()
+            self.logger.info(f"Optimized the ShortTermStorage, checkpoint (busy, log, checkpointed): {sts}")
+        except Exception as e:  # an uncaught error would stop the loop until the next restart
+            self.logger.error("Optimizing the databases failed, retrying with the next run", exc_info=e)
+
+    @tasks.loop(hours=USERSTATS_COMPACT_INTERVAL)
+    async def compact_stats(self):
+        """Rolls old user stats up into weeks, months and an all time row, so the userstats table stays small"""
+        try:
+            compacted = await self.client.db.compact_user_stats()
+        except Exception as e:  # an uncaught error would stop the loop until the next restart
+            self.logger.error("Compacting the user stats failed, retrying with the next run", exc_info=e)
+            return
+        self.logger.info(f"Compacted user stats, rolled up rows per period: {compacted}")
+
+    @tasks.loop(minutes=LEADERBOARD_PERSIST_INTERVAL)
+    async def persist_leaderboards(self):
+        try:
+            written = await self.client.db.leaderboard.persist()
+        except Exception as e:  # an uncaught error would stop the loop until the next restart
+            self.logger.error("Persisting the leaderboards failed, retrying with the next run", exc_info=e)
+            return
+        if written:
+            self.logger.debug(f"Persisted {written} leaderboard entries")
+
+    @commands.Cog.listener("on_start_done")
+    async def start_done(self):
+        self.optimize.start()
+        self.compact_stats.start()
+        self.persist_leaderboards.start()
+
+
+def setup(client):
+    client.add_cog(DBMaintenance(client))
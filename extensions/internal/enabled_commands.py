@@ -16,25 +16,18 @@ async def autocomplete_commands(ctx: discord.AutocompleteContext) -> list[str]:
     guild = ctx.interaction.guild
     if guild is None:
         return ["You can't disable commands in DMs."]  # Should not happen due to context restriction
-    all_commands = [
-        cmd.qualified_name
-        for cmd in bot.walk_application_commands()
-        if not isinstance(cmd, SlashCommandGroup) and cmd.name != "toggle-command"
-    ]
+    cog: EnabledCommands = bot.get_cog("EnabledCommands")  # type: ignore
+    all_commands = cog.get_executable_commands()
     filtered = []
-    if ctx.value:  # all_commands filter SlashCommandGroups because they are not executable commands
+    if ctx.value:
         filtered.extend([c for c in all_commands if ctx.value.lower() in c.lower()])
-    emojified_commands = []
+    shown = filtered if len(filtered) > 0 else all_commands
     try:
-        for cmd in filtered if len(filtered) > 0 else all_commands:
-            if await bot.db.is_command_enabled(guild=guild, command_name=cmd):
-                emojified_commands.append(f"🟢 {cmd}")
-            else:
-                emojified_commands.append(f"🔴 {cmd}")
-        return emojified_commands
+        states = await bot.db.get_command_states(guild=guild, command_names=shown)
+        return [f"🟢 {cmd}" if states[cmd] else f"🔴 {cmd}" for cmd in shown]
     except Exception as e:
         bot.logger.critical(f"Error emojifying commands_list: {e}")
-        return filtered if len(filtered) > 0 else all_commands
+        return shown
 
 
 class EnabledCommands(commands.Cog):
@@ -43,6 +36,17 @@ class EnabledCommands(commands.Cog):
         self.logger = CustomLogger(self.qualified_name, self.client.boot_time)
         self.client.add_check(self.command_enabled_check)
 
+    def get_executable_commands(self) -> list[str]:
+        """
+        Returns the qualified names of all commands that can be toggled. Built on every call, extensions can be loaded
+        and unloaded at runtime and walking the registered commands is cheap.
+        """
+        return [
+            cmd.qualified_name
+            for cmd in self.client.walk_application_commands()
+            if not isinstance(cmd, SlashCommandGroup) and cmd.name != "toggle-command"
+        ]  # SlashCommandGroups are filtered because they are not executable commands
+
     async def command_enabled_check(self, ctx: discord.ApplicationContext) -> bool:
         if not ctx.guild:
             return True
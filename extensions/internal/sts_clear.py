@@ -1,5 +1,3 @@
-from datetime import datetime
-
 from discord.ext import commands, tasks
 
 from utils import Bot, CustomLogger
@@ -12,10 +10,10 @@ class STSClear(commands.Cog):
 
     @tasks.loop(hours=1)
     async def delete_expired(self):
-        response = await self.client.sts.get_tagesschau_rows()
-        for row in response:
-            if row["expires"] < datetime.now():
-                await self.client.sts.delete_tagesschau_id(row["id"])
+        removed = await self.client.sts.purge_expired()
+        self.logger.info(
+            f"Removed {sum(removed.values())} expired rows ({', '.join(f'{t}: {n}' for t, n in removed.items())})"
+        )
 
     @commands.Cog.listener("on_start_done")
     async def start_done(self):
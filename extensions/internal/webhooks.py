@@ -1,8 +1,13 @@
+import asyncio
+import time
+
+import aiohttp
 import discord
 from discord.ext import commands, tasks
 from discord.utils import get_or_fetch
 
-from utils import Bot, CustomLogger
+from config import WEBHOOK_CONCURRENCY
+from utils import Bot, CustomLogger, Settings
 from utils.enums import SettingsEnum, WebhookType
 
 TAGESSCHAU_IMAGE = "https://www.ard.de/static/media/appIcon.ts.b846aebc4c4b299d0fbd.jpg"
@@ -13,12 +18,42 @@ class InternalHooks(commands.Cog):
         self.client: Bot = client
         self.logger = CustomLogger(self.qualified_name, self.client.boot_time)
         self.send_queue: list[tuple[discord.Embed, WebhookType]] = []  # tuple consists of our msg and a custom enum
-        self.webhooks = {}
+        self.webhooks: dict[int, dict[int, discord.Webhook]] = {}  # guild id -> channel id -> webhook
+        self.session: aiohttp.ClientSession = None  # type: ignore
+        self.send_semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+        self.bucket_locks: dict[int, asyncio.Lock] = {}  # webhook id -> lock, one request per rate limit bucket
+        self.bucket_blocked_until: dict[int, float] = {}  # webhook id -> monotonic time the bucket is free again
+
+    async def load_webhooks(self) -> None:
+        """
+        Fills the webhook cache from the database, so no webhook has to be fetched from discord after a restart.
+        """
+        rows = await self.client.db.get_webhooks()
+        for row in rows:
+            self.webhooks.setdefault(row.guild_id, {})[row.channel_id] = discord.Webhook.partial(
+                row.webhook_id, row.token, session=self.session
+            )
+        self.logger.debug(f"Loaded {len(rows)} webhooks from the database")
+
+    async def forget_webhooks(self, guild_id: int, channel_id: int | None = None) -> None:
+        """
+        Removes the webhook of a channel or all webhooks of a guild from the cache and the database.
+        Args:
+            guild_id: ``int`` The guild id the webhooks belong to.
+            channel_id: ``int | None`` The channel id to remove the webhook for. If None, all webhooks of the guild are
+             removed.
+        """
+        if channel_id is None:
+            self.webhooks.pop(guild_id, None)
+            await self.client.db.delete_webhooks(guild_id=guild_id)
+        else:
+            self.webhooks.get(guild_id, {}).pop(channel_id, None)
+            await self.client.db.delete_webhooks(channel_id=channel_id)
 
     async def get_or_fetch_webhook(self, guild_id: int, channel_id: int) -> discord.Webhook:
         """
         Tries getting a webhook from the local cache. if this fails it fetches the webhooks from the discord channel and
-         saves them to the cache.
+         saves them to the cache and the database.
         Args:
             guild_id: ``int`` The guild id of the channel you want to get the webhook for
             channel_id: ``int`` The channel id you want to get the webhooks from.
@@ -26,19 +61,18 @@ class InternalHooks(commands.Cog):
         Returns:
             ``discord.Webhook`` the webhook associated with this bot and the discord channel.
         """
+        if channel_id in self.webhooks.get(guild_id, {}):
+            return self.webhooks[guild_id][channel_id]  # if the webhook is cached, return it
         guild: discord.Guild = await get_or_fetch(self.client, "guild", guild_id, default=None)
         channel: discord.TextChannel = await get_or_fetch(guild, "channel", channel_id, default=None)
-        if str(guild_id) not in self.webhooks:
-            self.webhooks[str(guild_id)] = {}  # creating a new dict for the guild
-        if self.webhooks[str(guild_id)].get(str(channel_id)):
-            return self.webhooks[str(guild_id)][(str(channel_id))]  # if the webhook is cached, return it
         hooks = await channel.webhooks()  # else fetch all webhooks from our setting channel
         if f"{self.client.user.name} Webhook" in [hook.name for hook in hooks]:  # check if we have a webhook
             webhook = [hook for hook in hooks if hook.name == f"{self.client.user.name} Webhook"][0]
-            self.webhooks[str(guild_id)][str(channel_id)] = webhook  # select the webhook and save it to the cache
         else:
             webhook = await channel.create_webhook(name=f"{self.client.user.name} Webhook")
-            self.webhooks[str(guild_id)][str(channel_id)] = webhook  # else create the webhook and save it to the cache
+        self.webhooks.setdefault(guild_id, {})[channel_id] = webhook  # save the webhook to the cache
+        if webhook.token:
+            await self.client.db.set_webhook(guild_id, channel_id, webhook.id, webhook.token)
         return webhook
 
     @tasks.loop(minutes=1)
@@ -61,22 +95,80 @@ class InternalHooks(commands.Cog):
 
         [self.send_queue.remove(item) for item in rem_list]  # type: ignore
 
-        if sub_lists[WebhookType.Tagesschau] is not None:
+        if sub_lists.get(WebhookType.Tagesschau):
             resp = await self.client.db.get_setting(SettingsEnum.TagesschauChannel, None)
             # get all guilds which want news
             if resp is None:
                 return  # if no guild wants news, return
-            if len(resp) == 1:
-                webhook = await self.get_or_fetch_webhook(resp.guild, resp.value)  # type: ignore
-                await webhook.send(
-                    embeds=sub_lists[WebhookType.Tagesschau], username="Tagesschau", avatar_url=TAGESSCHAU_IMAGE
-                )
-                return
-            for setting in resp:  # type: ignore
-                webhook = await self.get_or_fetch_webhook(setting.guild, setting.value)
-                await webhook.send(
-                    embeds=sub_lists[WebhookType.Tagesschau], username="Tagesschau", avatar_url=TAGESSCHAU_IMAGE
+            settings = [resp] if isinstance(resp, Settings) else list(resp)
+            await self.fan_out(settings, sub_lists[WebhookType.Tagesschau], "Tagesschau", TAGESSCHAU_IMAGE)
+
+    async def fan_out(self, settings: list[Settings], embeds: list[discord.Embed], username: str, avatar_url: str):
+        """
+        Sends the embeds to the webhooks of all given channel settings concurrently. At most ``WEBHOOK_CONCURRENCY``
+        requests are in flight and every webhook (which is its own rate limit bucket) only gets one at a time.
+        Args:
+            settings: The channel settings of all receiving guilds.
+            embeds: The embeds to send.
+            username: The name the webhook messages are sent with.
+            avatar_url: The avatar the webhook messages are sent with.
+
+        Returns: None
+        """
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[self.deliver(setting, embeds, username, avatar_url) for setting in settings], return_exceptions=True
+        )
+        failures = 0
+        slowest: tuple[float, int] = (0.0, 0)
+        for setting, result in zip(settings, results):
+            if isinstance(result, BaseException):
+                failures += 1
+                self.logger.warning(
+                    f"Sending {username} to guild {setting.guild} channel {setting.value} failed: {result}"
                 )
+            else:
+                self.logger.debug(f"Sent {username} to guild {setting.guild} channel {setting.value} in {result:.2f}s")
+                slowest = max(slowest, (result, setting.guild))
+        self.logger.info(
+            f"Sent {len(embeds)} {username} messages to {len(settings) - failures}/{len(settings)} channels in "
+            f"{time.perf_counter() - start:.2f}s (slowest: guild {slowest[1]} {slowest[0]:.2f}s, {failures} failed)"
+        )
+
+    async def deliver(self, setting: Settings, embeds: list[discord.Embed], username: str, avatar_url: str) -> float:
+        """
+        Sends the embeds to the webhook of one channel setting. A stored webhook that no longer exists is replaced once.
+
+        Returns:
+            ``float`` the seconds it took to send the message.
+        """
+        async with self.send_semaphore:
+            start = time.perf_counter()
+            try:
+                await self.send_to_channel(setting, embeds, username, avatar_url)
+            except discord.NotFound:  # the webhook was deleted in discord
+                self.logger.info(f"Webhook for guild {setting.guild} channel {setting.value} is gone, replacing it")
+                await self.forget_webhooks(setting.guild, setting.value)
+                await self.send_to_channel(setting, embeds, username, avatar_url)
+            return time.perf_counter() - start
+
+    async def send_to_channel(self, setting: Settings, embeds: list[discord.Embed], username: str, avatar_url: str):
+        """
+        Sends the embeds to the webhook of one channel setting, waiting for its rate limit bucket if necessary.
+        """
+        webhook = await self.get_or_fetch_webhook(setting.guild, setting.value)
+        lock = self.bucket_locks.setdefault(webhook.id, asyncio.Lock())
+        async with lock:
+            blocked_for = self.bucket_blocked_until.get(webhook.id, 0) - time.monotonic()
+            if blocked_for > 0:
+                await asyncio.sleep(blocked_for)
+            try:
+                await webhook.send(embeds=embeds, username=username, avatar_url=avatar_url)
+            except discord.HTTPException as e:
+                if e.status == 429:  # the library already retried, leave the bucket alone for a while
+                    retry_after = float(e.response.headers.get("Retry-After", 60))
+                    self.bucket_blocked_until[webhook.id] = time.monotonic() + retry_after
+                raise
 
     @commands.Cog.listener("on_webhook_entry")
     async def on_webhook_entry(self, entries: list[tuple[discord.Embed, WebhookType]]):
@@ -84,8 +176,15 @@ class InternalHooks(commands.Cog):
         self.logger.debug(f"{len(entries)} messages added to queue.")
         self.logger.debug(f"{len(self.send_queue)} messages in queue.")
 
+    @commands.Cog.listener("on_setting_update")
+    async def on_setting_update(self, setting: SettingsEnum, guild: discord.Guild):
+        if setting == SettingsEnum.TagesschauChannel:
+            await self.forget_webhooks(guild.id)  # the webhooks of the old channel are no longer used
+
     @commands.Cog.listener("on_start_done")
     async def start_done(self):
+        self.session = aiohttp.ClientSession(headers={"User-Agent": f"Dragons BotV{self.client.client_version}"})
+        await self.load_webhooks()
         self.send_news.start()
 
 
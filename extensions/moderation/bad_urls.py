@@ -1,15 +1,50 @@
 import json
-import re
 import typing as t
 from datetime import datetime
+from pathlib import Path
 
 import aiohttp
 import discord
-from discord.ext import commands
+import pycord.multicog as pycog
+from discord.ext import commands, tasks
 from discord.utils import format_dt, get_or_fetch
 
-from config import GOOGLE_API_KEY
-from utils import Bot, CustomLogger, InfractionsEnum, SettingsEnum
+from config import (
+    GOOGLE_API_KEY,
+    SAFE_BROWSING_LOCAL,
+    SAFE_BROWSING_UPDATE_INTERVAL,
+    SAFE_BROWSING_URL,
+    URL_BATCH_SIZE,
+    URL_BATCH_WINDOW,
+    URL_CACHE_PERSIST,
+    URL_CACHE_SAFE_TTL,
+    URL_CACHE_SIZE,
+    URL_CACHE_UNSAFE_TTL,
+)
+from utils import (
+    GLOBAL_RULES,
+    Bot,
+    CustomLogger,
+    DomainRules,
+    InfractionsEnum,
+    LookupBatcher,
+    SafeBrowsingDB,
+    SettingsEnum,
+    VerdictCache,
+    extract_urls,
+    is_team,
+    normalize_domain,
+    url_host,
+)
+
+SCOPE_OPTION = discord.option(
+    "scope",
+    description="This server or every server, only the bot owner can change the rules of every server.",
+    input_type=str,
+    required=False,
+    default="guild",
+    choices=[discord.OptionChoice("This server", "guild"), discord.OptionChoice("All servers", "global")],
+)
 
 
 class BadURL(commands.Cog):
@@ -18,7 +53,82 @@ class BadURL(commands.Cog):
         self.logger = CustomLogger(self.qualified_name, self.client.boot_time)
         self.bad_hashes = []
         self.detect_session: aiohttp.ClientSession = None  # type: ignore
-        self.reg_url = r"(?:(?:https?|ftp):\/\/)?[\w/\-?=%.]+\.[\w/\-&?=%.]+"
+        self.verdicts = VerdictCache(URL_CACHE_SIZE, safe_ttl=URL_CACHE_SAFE_TTL, unsafe_ttl=URL_CACHE_UNSAFE_TTL)
+        self.batcher = LookupBatcher(self.lookup_urls, URL_BATCH_WINDOW, URL_BATCH_SIZE, self.logger)
+        self.threat_db = SafeBrowsingDB(
+            Path("data/safebrowsing"), SAFE_BROWSING_URL, GOOGLE_API_KEY, str(self.client.client_version), self.logger
+        )
+        self.domain_rules = DomainRules()
+
+    def cog_unload(self):
+        self.threat_db.close()
+
+    def match_domain_rules(self, guild_id: int, urls: list[str]) -> tuple[dict[str, bool], list[str]]:
+        """
+        Decides the urls whose host is on an allow or deny list of the guild or the global lists.
+
+        Returns: A dict of url -> unsafe for the decided urls and the urls no rule applies to.
+        """
+        verdicts = {}
+        unknown = []
+        for url in urls:
+            allowed = self.domain_rules.match(guild_id, url_host(url))
+            if allowed is None:
+                unknown.append(url)
+            else:
+                verdicts[url] = not allowed
+        return verdicts, unknown
+
+    async def check_urls(self, urls: list[str]) -> dict[str, bool]:
+        """
+        Returns whether each of the canonical urls is unsafe. Cached verdicts are used first, the remaining urls are
+        collected with the urls of other messages and checked together by ``lookup_urls``.
+        Urls whose verdict couldn't be determined are left out.
+        Args:
+            urls: The canonical urls to check, without duplicates.
+
+        Returns: A dict of url -> unsafe.
+        """
+        if GOOGLE_API_KEY == "":
+            return {}  # since no api key is given, we can't check for bad urls
+        verdicts = {}
+        missing = []
+        for url in urls:
+            verdict = self.verdicts.get(url)
+            if verdict is None:
+                missing.append(url)
+            else:
+                verdicts[url] = verdict
+        if not missing:
+            self.verdicts.saved_requests += 1
+            return verdicts
+        verdicts.update(await self.batcher.check(missing))
+        return verdicts
+
+    async def lookup_urls(self, urls: list[str]) -> dict[str, bool]:
+        """
+        Checks a batch of urls and caches the verdicts. The urls are matched against the local threat lists once they
+        are downloaded, or requested from the lookup api before.
+        Args:
+            urls: The canonical urls to check, at most ``URL_BATCH_SIZE``.
+
+        Returns: A dict of url -> unsafe, without the urls that couldn't be checked.
+        """
+        if SAFE_BROWSING_LOCAL and self.threat_db.ready:
+            found = await self.threat_db.lookup(urls)
+        else:
+            response = await self.bad_url(urls)
+            if response is False:
+                return {}
+            unsafe = {match["threat"]["url"] for match in response.get("matches", [])}
+            found = {url: url in unsafe for url in urls}
+        rows = []
+        for url, unsafe in found.items():
+            expires = self.verdicts.set(url, unsafe)
+            rows.append((url, unsafe, datetime.fromtimestamp(expires)))
+        if URL_CACHE_PERSIST and rows:
+            await self.client.sts.enter_url_verdicts(rows)
+        return found
 
     async def bad_url(self, listed_urls: list) -> dict | bool:
         if GOOGLE_API_KEY == "":
@@ -43,12 +153,15 @@ class BadURL(commands.Cog):
                     },
                 }
                 request = await self.detect_session.post(
-                    f"https://safebrowsing.googleapis.com/v4/threatMatches:find?key={GOOGLE_API_KEY}",
+                    f"{SAFE_BROWSING_URL}/threatMatches:find?key={GOOGLE_API_KEY}",
                     headers=headers,
                     data=json.dumps(data),
                 )
                 response = await request.json()
                 self.logger.debug(f"{request.status}: Requested safebrowsing api -> {json.dumps(data)}")
+                if request.status != 200:
+                    self.logger.error(f"{request.status}: Safebrowsing api returned an error -> {response}")
+                    return False
                 return response
             except Exception as e:
                 self.logger.critical("Fatal error", exc_info=e)
@@ -58,16 +171,15 @@ class BadURL(commands.Cog):
     async def message_event(self, msg: discord.Message) -> None:
         if msg.author.id == self.client.user.id:
             return
-        matches = re.finditer(self.reg_url, msg.content, re.MULTILINE)
-        urls = []
-        for match in matches:
-            if match is not None:
-                urls.append(match.group())
+        urls = extract_urls(msg.content)
         if len(urls) == 0:
             return
         else:
-            is_bad_store = await self.bad_url(urls)
-            if is_bad_store:  # false won't get to the for loop
+            # the domain lists decide first, only hosts without a rule are checked with safe browsing
+            verdicts, unknown = self.match_domain_rules(msg.guild.id if msg.guild else GLOBAL_RULES, urls)
+            if unknown and not any(verdicts.values()):
+                verdicts.update(await self.check_urls(unknown))
+            if any(verdicts.values()):
                 await msg.delete(reason="Detected as bad url")  # First delete the bad urls
                 case_id = await self.client.db.create_infraction(
                     user=msg.author, infraction=InfractionsEnum.Warn, reason="Bad URL sent", guild=msg.guild
@@ -98,9 +210,114 @@ class BadURL(commands.Cog):
                     if log_channel:
                         await log_channel.send(embed=em)
 
+    async def scope_guild_id(self, ctx: discord.ApplicationContext, scope: str) -> int | None:
+        """Returns the guild id of the rules a command changes, None if the author may not change global rules"""
+        if scope == "global":
+            if not await self.client.is_owner(ctx.author):
+                await ctx.response.send_message(
+                    "Only the bot owner can change the global domain lists.", ephemeral=True
+                )
+                return None
+            return GLOBAL_RULES
+        return ctx.guild.id
+
+    async def set_domain_rule(self, ctx: discord.ApplicationContext, domain: str, scope: str, allowed: bool):
+        guild_id = await self.scope_guild_id(ctx, scope)
+        if guild_id is None:
+            return
+        host = normalize_domain(domain)
+        if host is None:
+            return await ctx.response.send_message(f"`{domain}` is not a valid domain.", ephemeral=True)
+        await self.client.db.set_domain_rule(guild_id, host, allowed)
+        self.domain_rules.add(guild_id, host, allowed)
+        where = "every server" if guild_id == GLOBAL_RULES else "this server"
+        self.logger.info(f"{ctx.author} {'allowed' if allowed else 'denied'} {host} in {where} ({guild_id})")
+        await ctx.response.send_message(
+            f"{'✅' if allowed else '🚫'} Links to `{host}` and its subdomains are now "
+            f"{'allowed' if allowed else 'deleted'} in {where}.",
+            ephemeral=True,
+        )
+
+    @pycog.subcommand("domain")
+    @commands.slash_command(name="allow", description="Allows links to a domain without checking them")
+    @commands.check_any(is_team(), commands.is_owner())
+    @discord.option("domain", description="The domain to allow, e.g. example.com", input_type=str, required=True)
+    @SCOPE_OPTION
+    async def allow_domain(self, ctx: discord.ApplicationContext, domain: str, scope: str):
+        await self.set_domain_rule(ctx, domain, scope, allowed=True)
+
+    @pycog.subcommand("domain")
+    @commands.slash_command(name="deny", description="Deletes every link to a domain")
+    @commands.check_any(is_team(), commands.is_owner())
+    @discord.option("domain", description="The domain to deny, e.g. example.com", input_type=str, required=True)
+    @SCOPE_OPTION
+    async def deny_domain(self, ctx: discord.ApplicationContext, domain: str, scope: str):
+        await self.set_domain_rule(ctx, domain, scope, allowed=False)
+
+    @pycog.subcommand("domain")
+    @commands.slash_command(name="remove", description="Removes the rule of a domain")
+    @commands.check_any(is_team(), commands.is_owner())
+    @discord.option("domain", description="The domain to remove the rule of", input_type=str, required=True)
+    @SCOPE_OPTION
+    async def remove_domain(self, ctx: discord.ApplicationContext, domain: str, scope: str):
+        guild_id = await self.scope_guild_id(ctx, scope)
+        if guild_id is None:
+            return
+        host = normalize_domain(domain) or domain
+        if not await self.client.db.delete_domain_rule(guild_id, host):
+            return await ctx.response.send_message(f"There is no rule for `{host}`.", ephemeral=True)
+        self.domain_rules.remove(guild_id, host)
+        self.logger.info(f"{ctx.author} removed the rule of {host} ({guild_id})")
+        await ctx.response.send_message(f"The rule for `{host}` was removed.", ephemeral=True)
+
+    @pycog.subcommand("domain")
+    @commands.slash_command(name="list", description="Shows the allowed and denied domains")
+    @commands.check_any(is_team(), commands.is_owner())
+    @SCOPE_OPTION
+    async def list_domains(self, ctx: discord.ApplicationContext, scope: str):
+        guild_id = GLOBAL_RULES if scope == "global" else ctx.guild.id
+        rules = await self.client.db.get_domain_rules(guild_id)
+        container = discord.ui.Container()
+        container.add_text(f"## Domain rules of {'all servers' if guild_id == GLOBAL_RULES else ctx.guild.name}")
+        if not rules:
+            container.add_text("There are no domain rules yet.")
+        for allowed, title in ((True, "Allowed"), (False, "Denied")):
+            domains = [f"`{rule.domain}`" for rule in rules if rule.allowed is allowed]
+            if domains:
+                container.add_text(f"### {title}\n" + ", ".join(domains)[:3900])
+        await ctx.response.send_message(view=discord.ui.DesignerView(container), ephemeral=True)
+
+    @tasks.loop(minutes=SAFE_BROWSING_UPDATE_INTERVAL)
+    async def update_threat_lists(self):
+        try:
+            await self.threat_db.update()
+        except Exception as e:  # an uncaught error would stop the loop and the local lists would go stale
+            self.logger.error("Couldn't update the local threat lists, retrying with the next run", exc_info=e)
+
+    @tasks.loop(hours=1)
+    async def log_verdict_cache(self):
+        self.logger.info(f"URL verdict cache: {self.verdicts.info()}")
+        self.logger.info(f"Domain rules: {len(self.domain_rules)} rules decided {self.domain_rules.hits} urls")
+        if self.batcher.batches:
+            self.logger.info(
+                f"URL batches: {self.batcher.batched_urls} urls in {self.batcher.batches} batches "
+                f"({self.batcher.batched_urls / self.batcher.batches:.1f} urls per batch)"
+            )
+
     @commands.Cog.listener("on_start_done")
     async def bad_urls_done(self):
         self.detect_session = aiohttp.ClientSession(headers={"User-Agent": f"Dragons BotV{self.client.client_version}"})
+        rules = await self.client.db.get_domain_rules()
+        self.domain_rules.load((rule.guild_id, rule.domain, rule.allowed) for rule in rules)
+        self.logger.info(f"Loaded {len(self.domain_rules)} domain rules")
+        if URL_CACHE_PERSIST:
+            for url, unsafe, expires in reversed(await self.client.sts.get_url_verdicts(URL_CACHE_SIZE)):
+                self.verdicts.set(url, unsafe, expires.timestamp())
+            self.logger.info(f"Loaded {len(self.verdicts)} url verdicts from the short term storage")
+        self.log_verdict_cache.start()
+        if SAFE_BROWSING_LOCAL and GOOGLE_API_KEY != "":
+            self.threat_db.load(self.detect_session)
+            self.update_threat_lists.start()
 
 
 def setup(client):
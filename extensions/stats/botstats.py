@@ -1,20 +1,33 @@
-from datetime import datetime
+import time
+from datetime import date
 
 import discord
 from discord.ext import commands, tasks
+from sqlalchemy.exc import SQLAlchemyError
 
 import utils
+from config import STAT_FLUSH_INTERVAL
 from utils import Bot, CustomLogger
 
 
-class TimedUser:
-    def __init__(self, user: discord.Member, guild: discord.Guild):
-        self.user = user
-        self.guild = guild
-        self.time = datetime.now()
+class VoiceSession:
+    """A member in a voice channel. ``start`` is a ``time.monotonic()`` stamp, so clock changes don't skew it"""
+
+    __slots__ = ("guild_id", "user_id", "start")
+
+    def __init__(self, guild_id: int, user_id: int):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.start = time.monotonic()
+
+    def accrue(self, now: float) -> int:
+        """Returns the whole seconds since ``start`` and moves ``start`` forward by them, keeping the remainder"""
+        seconds = int(now - self.start)
+        self.start += seconds
+        return seconds
 
     def __repr__(self):
-        return f"TimedUser(user={self.user}, guild={self.guild}, time={(datetime.now() - self.time).total_seconds()})"
+        return f"VoiceSession(guild_id={self.guild_id}, user_id={self.user_id}, time={time.monotonic() - self.start})"
 
 
 class BotStats(commands.Cog):
@@ -24,56 +37,59 @@ class BotStats(commands.Cog):
         self.pings = []
         self.avg_ping.start()
         self.save_voice_to_db.start()
-        self.voice_time_cache = {}  # structure: {guild_id: {user_id: TimedUser}}}
+        self.flush_stats.start()
+        self.voice_sessions: dict[tuple[int, int], VoiceSession] = {}  # (guild_id, user_id) -> session
 
-    def _add_or_update_user(self, user: discord.Member, guild: discord.Guild) -> None:
+    def _start_session(self, guild_id: int, user_id: int) -> None:
         """
-        Adds a user to the voice_time_cache or updates their time if they already exist.
+        Starts counting the voice time of a user, restarting a running session.
         Args:
-            user: The user to add or update.
-            guild: The guild the voice time is counted in.
-
-        Returns:
+            guild_id: The guild the voice time is counted in.
+            user_id: The user to count the voice time for.
 
+        Returns: None
         """
-        if str(guild.id) not in self.voice_time_cache:
-            self.voice_time_cache[str(guild.id)] = {}
-        self.voice_time_cache[str(guild.id)][str(user.id)] = TimedUser(user, guild)
+        self.voice_sessions[(guild_id, user_id)] = VoiceSession(guild_id, user_id)
 
-    def _get_user(self, guild: int, user: int) -> TimedUser | None:
+    async def _end_session(self, guild_id: int, user_id: int) -> None:
         """
-        Gets a user from the voice_time_cache.
+        Stops counting the voice time of a user. The seconds that weren't saved yet are added to the stat buffer, which
+        is written together with the message and command stats and flushed on shutdown.
         Args:
-            guild: the guild id to get the user from.
-            user: the user id to get the user from.
-
-        Returns: TimedUser | None
+            guild_id: The guild the voice time is counted in.
+            user_id: The user to stop counting the voice time for.
 
+        Returns: None
         """
-        try:
-            return self.voice_time_cache[str(guild)][str(user)]
-        except KeyError:
-            self.logger.warning(f"Couldn't get user: {user}, guild: {guild} | Voice Cache: {self.voice_time_cache}")
-            return None
+        session = self.voice_sessions.pop((guild_id, user_id), None)
+        if session is None:
+            return  # deafened members have no session
+        seconds = session.accrue(time.monotonic())
+        if seconds:
+            await self.client.db.stat_buffer.add(guild_id, user_id, utils.StatTypeEnum.VoiceTime, seconds)
 
-    def _delete_user(self, guild: int, user: int):
-        """
-        Deletes a user from the voice_time_cache.
-        Args:
-            guild: The guild id to delete the user from.
-            user: The user id to delete.
+    def cog_unload(self):
+        self.avg_ping.cancel()
+        # stopped instead of cancelled, so a running write isn't interrupted and its stats aren't lost
+        self.flush_stats.stop()
+        self.save_voice_to_db.stop()
+        self.buffer_voice_sessions()
+        self.voice_sessions.clear()
 
-        Returns:
+    def buffer_voice_sessions(self) -> None:
+        """
+        Adds the seconds of all running sessions that weren't saved yet to the stat buffer and keeps the sessions
+        running. Called on unload and before the database is closed, which flushes the buffer.
 
+        Returns: None
         """
-        try:
-            del self.voice_time_cache[str(guild)][str(user)]
-            if len(self.voice_time_cache[str(guild)]) == 0:
-                del self.voice_time_cache[str(guild)]
-        except KeyError:
-            return self.logger.error(
-                f"Couldn't get user: {user}, guild: {guild} | Voice Cache: {self.voice_time_cache}"
-            )
+        if self.client.db is None:
+            return
+        now = time.monotonic()
+        for session in self.voice_sessions.values():
+            seconds = session.accrue(now)
+            if seconds:
+                self.client.db.stat_buffer.put(session.guild_id, session.user_id, utils.StatTypeEnum.VoiceTime, seconds)
 
     @tasks.loop(minutes=1)
     async def avg_ping(self) -> None:
@@ -100,7 +116,7 @@ class BotStats(commands.Cog):
         """
         if not cmd.guild:
             return
-        await self.client.db.update_user_stat(cmd.author, utils.StatTypeEnum.CommandsUsed, 1, cmd.guild)
+        await self.client.db.buffer_user_stat(cmd.author, utils.StatTypeEnum.CommandsUsed, 1, cmd.guild)
 
     @commands.Cog.listener("on_message")
     async def on_msg(self, msg: discord.Message) -> None:
@@ -116,42 +132,48 @@ class BotStats(commands.Cog):
             return
         if not msg.guild:
             return
-        await self.client.db.update_user_stat(msg.author, utils.StatTypeEnum.MessagesSent, 1, msg.guild)
+        await self.client.db.buffer_user_stat(msg.author, utils.StatTypeEnum.MessagesSent, 1, msg.guild)
 
-    @tasks.loop(minutes=5)
-    async def save_voice_to_db(self) -> None:
+    @tasks.loop(seconds=STAT_FLUSH_INTERVAL)
+    async def flush_stats(self) -> None:
         """
-        Saves the voice time of all users in the voice_time_cache to the database. And resets their time in the cache.
+        Writes the buffered message and command stats to the database.
         Returns: None
 
         """
         await self.client.wait_until_ready()
-        for guild_id in self.voice_time_cache:
-            for user_id in self.voice_time_cache[guild_id]:
-                user: TimedUser = self.voice_time_cache[guild_id][user_id]
-                await self._update_voice_seconds(user.user, user.guild, update=True)
-                self._add_or_update_user(user.user, user.guild)
+        if self.client.db is None:
+            return  # the loop starts with the cog, the database is set up in Bot.start
+        try:
+            await self.client.db.stat_buffer.flush()
+        except Exception as e:  # an uncaught error would stop the loop until the next restart
+            self.logger.error("Flushing the user stats failed, retrying with the next run", exc_info=e)
 
-    async def _update_voice_seconds(self, member: discord.Member, guild: discord.Guild, update: bool = False) -> None:
+    @tasks.loop(minutes=5)
+    async def save_voice_to_db(self) -> None:
         """
-        Updates the voice time of a member in the database. If `update` is False, it will delete the user from the cache.
-        Args:
-            member: The discord member to update the voice time for.
-            guild: The guild to update the voice time in.
-            update: The boolean to determine if the user should be deleted from the cache after updating.
-
+        Saves the voice time of all running sessions to the database with one bulk write and keeps the sessions running.
         Returns: None
 
         """
-        timed_user = self._get_user(guild.id, member.id)
-        if timed_user is None:
+        await self.client.wait_until_ready()
+        if not self.voice_sessions:
+            return
+        now = time.monotonic()
+        today = date.today()
+        stats = {}
+        for session in self.voice_sessions.values():
+            seconds = session.accrue(now)  # moved forward before the write, sessions ending meanwhile don't count twice
+            if seconds:
+                stats[(session.guild_id, session.user_id, utils.StatTypeEnum.VoiceTime.value, today)] = seconds
+        try:
+            await self.client.db.update_user_stats(stats)
+        except SQLAlchemyError as e:
+            self.logger.error(f"Couldn't save the voice time of {len(stats)} users, buffering it", exc_info=e)
+            for (guild_id, user_id, _, day), seconds in stats.items():
+                await self.client.db.stat_buffer.add(guild_id, user_id, utils.StatTypeEnum.VoiceTime, seconds, day)
             return
-        db_time = int((datetime.now() - timed_user.time).total_seconds())
-        await self.client.db.update_user_stat(
-            user=member, stat_type=utils.StatTypeEnum.VoiceTime, value=db_time, guild=guild
-        )
-        if not update:
-            self._delete_user(guild.id, member.id)
+        self.logger.debug(f"Saved the voice time of {len(stats)} users")
 
     @commands.Cog.listener("on_voice_state_update")
     async def on_voice_state_update(
@@ -173,20 +195,21 @@ class BotStats(commands.Cog):
                     if before.channel.guild.id == after.channel.guild.id:
                         return  # don't care if it's still the same discord guild
                     else:
-                        await self._update_voice_seconds(member, member.guild)
-                        self._add_or_update_user(member, member.guild)  # if they switched servers
+                        await self._end_session(member.guild.id, member.id)
+                        self._start_session(member.guild.id, member.id)  # if they switched servers
                 else:
-                    if after.self_deaf:
-                        await self._update_voice_seconds(member, member.guild)
+                    if after.self_deaf and not before.self_deaf:
+                        await self._end_session(member.guild.id, member.id)
                         # we don't want to count the members time if they are deafened
                     if before.self_deaf and not after.self_deaf:
-                        self._add_or_update_user(member, member.guild)
+                        self._start_session(member.guild.id, member.id)
                         # but we want to start counting again if they've undeafen themselves
                     return  # this path is triggered if someone does something in a voice channel
             else:
-                await self._update_voice_seconds(member, member.guild)  # if they left a voice channel
+                await self._end_session(member.guild.id, member.id)  # if they left a voice channel
         elif after.channel:
-            self._add_or_update_user(member, member.guild)  # if they joined a voice channel
+            if not after.self_deaf:
+                self._start_session(member.guild.id, member.id)  # if they joined a voice channel
         else:
             self.logger.error("Neither before nor after channel")
             return
@@ -195,7 +218,7 @@ class BotStats(commands.Cog):
     async def on_start_done(self):
         """
         A helper function that is called when the bot is ready.\n
-        It discovers all voice channels and adds all users to the voice_time_cache.
+        It discovers all voice channels and starts a voice session for every member that isn't deafened.
         Returns: None
 
         """
@@ -205,7 +228,7 @@ class BotStats(commands.Cog):
                     if member.voice.self_deaf:
                         pass
                     else:
-                        self._add_or_update_user(member, guild)
+                        self._start_session(guild.id, member.id)
 
 
 def setup(client):
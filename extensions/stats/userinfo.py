@@ -5,7 +5,7 @@ from discord.ext import commands
 from discord.utils import format_dt
 from pycord import multicog as pycog
 
-from utils import Bot, CustomLogger, StatTypeEnum, sec_to_readable, SettingsEnum, ContainerPaginator
+from utils import Bot, CustomLogger, StatPeriodEnum, StatTypeEnum, sec_to_readable, SettingsEnum, ContainerPaginator
 from utils.orm_database import Infractions, Settings
 
 
@@ -105,18 +105,15 @@ class UserInfo(commands.Cog):
             or ctx.author.guild_permissions.manage_guild
         ):
             container.add_separator()
-            # Database calls
-            voice_time = await self.client.db.get_user_stat_total(target, StatTypeEnum.VoiceTime, ctx.guild)
-            messages_sent = await self.client.db.get_user_stat_total(target, StatTypeEnum.MessagesSent, ctx.guild)
-            commands_used = await self.client.db.get_user_stat_total(target, StatTypeEnum.CommandsUsed, ctx.guild)
-            infractions = await self.client.db.get_infraction(None, target, ctx.guild)
+            # Database call
+            totals = await self.client.db.get_user_totals(target, ctx.guild)
             container.add_text(
-                f"Voice time 🎤: {sec_to_readable(voice_time or 0)}\n"
-                f"Messages sent 💬: {messages_sent or '0'}\n"
-                f"Commands used ⚡: {commands_used or '0'}\n"
-                f"Infractions 🚨: {len(infractions) if infractions else '0'}"
+                f"Voice time 🎤: {sec_to_readable(totals.voice_time if totals else 0)}\n"
+                f"Messages sent 💬: {totals.messages_sent if totals else '0'}\n"
+                f"Commands used ⚡: {totals.commands_used if totals else '0'}\n"
+                f"Infractions 🚨: {totals.infractions if totals else '0'}"
             )
-            if infractions:
+            if totals and totals.infractions:
                 container.add_section(
                     discord.ui.TextDisplay(content="See all infractions for this user"),
                     accessory=InfractionButton(client=self.client, target=target),
@@ -131,6 +128,49 @@ class UserInfo(commands.Cog):
 
         await ctx.response.send_message(view=discord.ui.DesignerView(container), ephemeral=True)
 
+    @pycog.subcommand("user")
+    @commands.slash_command(
+        name="leaderboard",
+        description="Shows the most active members of this server.",
+    )
+    @discord.option(
+        "stat",
+        description="What the members are ranked by.",
+        input_type=str,
+        required=True,
+        choices=[
+            discord.OptionChoice("Messages sent", StatTypeEnum.MessagesSent.value),
+            discord.OptionChoice("Voice time", StatTypeEnum.VoiceTime.value),
+            discord.OptionChoice("Commands used", StatTypeEnum.CommandsUsed.value),
+        ],
+    )
+    @discord.option(
+        "period",
+        description="The time span that is ranked.",
+        input_type=str,
+        required=False,
+        default=StatPeriodEnum.All.value,
+        choices=[
+            discord.OptionChoice("This week", StatPeriodEnum.Week.value),
+            discord.OptionChoice("This month", StatPeriodEnum.Month.value),
+            discord.OptionChoice("All time", StatPeriodEnum.All.value),
+        ],
+    )
+    async def leaderboard(self, ctx: discord.ApplicationContext, stat: str, period: str):
+        stat_type = StatTypeEnum(stat)
+        top = self.client.db.get_leaderboard(ctx.guild, stat_type, StatPeriodEnum(period))
+        container = discord.ui.Container()
+        container.add_text(f"## Leaderboard of {ctx.guild.name}")
+        if not top:
+            container.add_text("Nobody is on this leaderboard yet.")
+        else:
+            lines = []
+            for rank, (user_id, value) in enumerate(top, start=1):
+                shown = sec_to_readable(value) if stat_type == StatTypeEnum.VoiceTime else value
+                lines.append(f"**{rank}.** <@{user_id}> {shown}")
+            container.add_text("\n".join(lines))
+        await ctx.response.send_message(view=discord.ui.DesignerView(container), ephemeral=True)
+
 
 def setup(client):
     client.add_cog(UserInfo(client))
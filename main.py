@@ -13,7 +13,7 @@ from discord.ext import commands
 
 import config
 from config import DISCORD_API_KEY
-from utils import Bot, ORMDataBase, ShortTermStorage, VersionInfo, rem_log
+from utils import Bot, VersionInfo, rem_log
 from utils.logger import CustomFormatter
 
 bot = Bot(
@@ -29,12 +29,7 @@ bot = Bot(
 
 @bot.listen("on_ready", once=True)
 async def on_boot():
-    bot.sts = ShortTermStorage(path="data/sts.sqlite")
-    await bot.sts.setup(bot.boot_time)
-    bot.logger.debug("Initialized sts db")
-    bot.db = ORMDataBase()
-    await bot.db.setup(bot.boot_time)
-    bot.logger.debug("Initialized content db")
+    # the databases are set up in Bot.start, before the gateway connection
     bot.api = aiohttp.ClientSession(
         "https://discord.com",
         headers={"Authorization": "Bot " + DISCORD_API_KEY, "User-Agent": f"Dragons BotV{bot.client_version}"},
@@ -0,0 +1,170 @@
+"""
+Offline tests of the local safe browsing database. The update api is served by a local aiohttp fixture server.
+
+Run with: python -m pytest tests
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from utils.safebrowsing import THREAT_TYPES, SafeBrowsingDB, ThreatList, url_hashes
+
+EVIL_URL = "http://evil.example/"
+SAFE_URL = "http://safe.example/"
+logger = logging.getLogger("test_safebrowsing")
+
+
+def list_update(threat_type: str, prefixes: list[bytes], *, full=True, removals=(), state="state", checksum=None):
+    """Builds a list update response the way the api sends it, with the checksum of ``prefixes``"""
+    update = {
+        "threatType": threat_type,
+        "responseType": "FULL_UPDATE" if full else "PARTIAL_UPDATE",
+        "newClientState": state,
+        "checksum": {
+            "sha256": base64.b64encode(checksum or hashlib.sha256(b"".join(sorted(prefixes))).digest()).decode()
+        },
+    }
+    if removals:
+        update["removals"] = [{"rawIndices": {"indices": list(removals)}}]
+    return update
+
+
+def with_additions(update: dict, additions: list[bytes]) -> dict:
+    if additions:
+        update["additions"] = [
+            {
+                "rawHashes": {
+                    "prefixSize": len(additions[0]),
+                    "rawHashes": base64.b64encode(b"".join(additions)).decode(),
+                }
+            }
+        ]
+    return update
+
+
+class FixtureServer:
+    """Answers threatListUpdates:fetch and fullHashes:find with queued responses and records the requests"""
+
+    def __init__(self):
+        self.updates: list[dict] = []
+        self.full_hashes: list[bytes] = []
+        self.requests: list[tuple[str, dict]] = []
+        app = web.Application()
+        app.router.add_post("/v4/threatListUpdates:fetch", self.fetch)
+        app.router.add_post("/v4/fullHashes:find", self.find)
+        self.server = TestServer(app)
+
+    async def fetch(self, request: web.Request) -> web.Response:
+        self.requests.append(("fetch", await request.json()))
+        return web.json_response({"listUpdateResponses": self.updates, "minimumWaitDuration": "0s"})
+
+    async def find(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.requests.append(("find", data))
+        prefixes = {base64.b64decode(entry["hash"]) for entry in data["threatInfo"]["threatEntries"]}
+        matches = [
+            {"threatType": "MALWARE", "threat": {"hash": base64.b64encode(full_hash).decode()}}
+            for full_hash in self.full_hashes
+            if any(full_hash.startswith(prefix) for prefix in prefixes)
+        ]
+        return web.json_response({"matches": matches})
+
+
+async def run_with_db(tmp_path, server: FixtureServer, test):
+    await server.server.start_server()
+    db = SafeBrowsingDB(tmp_path, str(server.server.make_url("/v4")), "key", "test", logger)  # type: ignore
+    try:
+        async with aiohttp.ClientSession() as session:
+            db.load(session)
+            await test(db)
+    finally:
+        db.close()
+        await server.server.close()
+
+
+def test_apply_full_and_partial_update(tmp_path):
+    threat_list = ThreatList(tmp_path, "MALWARE")
+    prefixes = [b"cccc", b"aaaa", b"bbbb"]
+    assert threat_list.apply(with_additions(list_update("MALWARE", prefixes, state="one"), prefixes)) == 3
+    assert threat_list.load()
+    assert list(threat_list.prefixes[4]) == [b"aaaa", b"bbbb", b"cccc"]
+    assert threat_list.state == "one"
+
+    # removal indices refer to the sorted prefixes before the update: 1 is b"bbbb"
+    expected = [b"aaaa", b"cccc", b"dd", b"dddd"]
+    update = list_update("MALWARE", expected, full=False, removals=[1], state="two")
+    update["additions"] = [
+        {"rawHashes": {"prefixSize": 4, "rawHashes": base64.b64encode(b"dddd").decode()}},
+        {"rawHashes": {"prefixSize": 2, "rawHashes": base64.b64encode(b"dd").decode()}},
+    ]
+    assert threat_list.apply(update) == 4
+    assert threat_list.load()
+    assert list(threat_list.prefixes[4]) == [b"aaaa", b"cccc", b"dddd"]
+    assert list(threat_list.prefixes[2]) == [b"dd"]
+    assert sorted(threat_list.hits(b"ddddxxxx")) == [b"dd", b"dddd"]
+    assert threat_list.state == "two"
+    threat_list.close()
+
+
+def test_apply_checksum_mismatch_writes_nothing(tmp_path):
+    threat_list = ThreatList(tmp_path, "MALWARE")
+    threat_list.apply(with_additions(list_update("MALWARE", [b"aaaa"], state="one"), [b"aaaa"]))
+    update = with_additions(list_update("MALWARE", [], full=False, state="two", checksum=b"x" * 32), [b"bbbb"])
+    with pytest.raises(ValueError):
+        threat_list.apply(update)
+    assert threat_list.load()
+    assert list(threat_list.prefixes[4]) == [b"aaaa"]
+    assert threat_list.state == "one"
+    threat_list.close()
+
+
+def test_load_resets_incomplete_copy(tmp_path):
+    (tmp_path / "MALWARE.json").write_text(json.dumps({"state": "one", "sizes": [4]}))  # the prefix file is missing
+    threat_list = ThreatList(tmp_path, "MALWARE")
+    assert not threat_list.load()
+    assert threat_list.state == ""
+    assert not (tmp_path / "MALWARE.json").exists()
+
+
+def test_update_and_lookup(tmp_path):
+    evil_hash = url_hashes(EVIL_URL)[0]
+    server = FixtureServer()
+    server.updates = [with_additions(list_update(name, [evil_hash[:4]]), [evil_hash[:4]]) for name in THREAT_TYPES]
+    server.full_hashes = [evil_hash]
+
+    async def test(db: SafeBrowsingDB):
+        assert not db.ready
+        assert await db.update()
+        assert db.ready
+        assert await db.lookup([EVIL_URL, SAFE_URL]) == {EVIL_URL: True, SAFE_URL: False}
+        finds = [data for method, data in server.requests if method == "find"]
+        assert len(finds) == 1  # only the url with a prefix hit is confirmed
+        assert finds[0]["threatInfo"]["threatEntries"] == [{"hash": base64.b64encode(evil_hash[:4]).decode()}]
+        assert await db.lookup([SAFE_URL]) == {SAFE_URL: False}
+        assert len(server.requests) == 2  # cleared locally, without a request
+
+    asyncio.run(run_with_db(tmp_path, server, test))
+
+
+def test_update_resets_list_on_checksum_mismatch(tmp_path):
+    server = FixtureServer()
+    server.updates = [with_additions(list_update(name, [b"aaaa"]), [b"aaaa"]) for name in THREAT_TYPES]
+    server.updates[0] = with_additions(list_update(THREAT_TYPES[0], [], checksum=b"x" * 32), [b"aaaa"])
+
+    async def test(db: SafeBrowsingDB):
+        await db.update()
+        assert db.lists[THREAT_TYPES[0]].state == ""
+        assert all(db.lists[name].state == "state" for name in THREAT_TYPES[1:])
+        await db.update()
+        states = [update["state"] for update in server.requests[-1][1]["listUpdateRequests"]]
+        assert states == ["", "state", "state"]  # the reset list is requested as full update
+
+    asyncio.run(run_with_db(tmp_path, server, test))
@@ -2,9 +2,13 @@ from .bot import Bot
 from .checks import is_team
 from .classes import CommandDisabledError, InsufficientPermission, Event
 from .database import ShortTermStorage
-from .enums import InfractionsEnum, SettingsEnum, StatTypeEnum, WebhookType
+from .domain_rules import GLOBAL_RULES, DomainRules, normalize_domain, url_host
+from .enums import InfractionsEnum, SettingsEnum, StatPeriodEnum, StatTypeEnum, WebhookType
 from .logger import CustomLogger, rem_log
 from .orm_database import ORMDataBase, Settings
+from .safebrowsing import SafeBrowsingDB
+from .url_verdicts import LookupBatcher, VerdictCache
+from .urls import canonicalize_url, extract_urls
 from .utils import VersionInfo, sec_to_readable
 from .views import ButtonConfirm, ButtonInfo, ContainerPaginator
 
@@ -17,11 +21,21 @@ __all__ = [
     "InfractionsEnum",
     "SettingsEnum",
     "StatTypeEnum",
+    "StatPeriodEnum",
     "WebhookType",
     "CustomLogger",
     "rem_log",
     "ORMDataBase",
     "Settings",
+    "SafeBrowsingDB",
+    "VerdictCache",
+    "LookupBatcher",
+    "canonicalize_url",
+    "DomainRules",
+    "GLOBAL_RULES",
+    "normalize_domain",
+    "url_host",
+    "extract_urls",
     "VersionInfo",
     "sec_to_readable",
     "ButtonConfirm",
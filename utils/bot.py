@@ -7,11 +7,11 @@ from pycord.multicog import Bot as MulticogBot
 
 from config import IPC_SECRET
 
+from .database import ShortTermStorage
 from .logger import CustomLogger
+from .orm_database import ORMDataBase
 
 if TYPE_CHECKING:
-    from .database import ShortTermStorage
-    from .orm_database import ORMDataBase
     from .utils import VersionInfo
 
 
@@ -27,3 +27,31 @@ class Bot(
         self.sts: ShortTermStorage = None  # type: ignore
         self.ipc = ipc.Server(self, secret_key=IPC_SECRET)
         self.logger = CustomLogger(name="core", start_stamp=self.boot_time)
+
+    async def start(self, token: str, *, reconnect: bool = True) -> None:
+        """
+        Sets up the databases and applies pending migrations before connecting, so no event is handled without them
+        """
+        self.sts = ShortTermStorage(path="data/sts.sqlite")
+        await self.sts.setup(self.boot_time)
+        self.logger.debug("Initialized sts db")
+        self.db = ORMDataBase()
+        await self.db.setup(self.boot_time)
+        self.logger.debug("Initialized content db")
+        await super().start(token, reconnect=reconnect)
+
+    async def close(self):
+        for name in list(self.extensions):
+            try:
+                self.unload_extension(name)  # lets the cogs hand their state over in cog_unload, e.g. voice sessions
+            except Exception as e:
+                self.logger.error(f"Couldn't unload {name} while closing", exc_info=e)
+        try:
+            if self.db is not None:
+                await self.db.close()  # flushes the buffered user stats
+        finally:
+            try:
+                if self.sts is not None:
+                    await self.sts.close()
+            finally:
+                await super().close()
@@ -4,6 +4,7 @@ from pathlib import Path
 import aiosqlite
 
 from .logger import CustomLogger
+from .sqlite_profile import SQLITE_PRAGMAS, pragma_statements
 
 
 def datetime_to_db(val):
@@ -19,6 +20,8 @@ def db_to_datetime(val):
 aiosqlite.register_adapter(datetime, datetime_to_db)
 aiosqlite.register_converter("DATETIME", db_to_datetime)
 
+BATCH_SIZE = 500  # ids per IN (...) query, keeps SQLite below its bound parameter limit
+
 
 class ShortTermStorage:
     def __init__(self, path: str | Path):
@@ -27,6 +30,7 @@ class ShortTermStorage:
         if not isinstance(path, Path):
             path = Path(path)
         self.path: Path = path
+        self.ttl_tables: set[str] = set()
 
     async def setup(self, boot: datetime):
         """Create new tables in the database if they don't already exist"""
@@ -36,29 +40,95 @@ class ShortTermStorage:
             self.path.touch()
             self.logger.info("Created database path/file")
         self.db = await aiosqlite.connect(self.path, detect_types=1)
-        async with self.db.cursor() as cursor:
-            await cursor.execute("CREATE TABLE IF NOT EXISTS tagesschau (id TEXT, updated DATETIME, expires DATETIME)")
+        for statement in pragma_statements():
+            await self.db.execute(statement)
+        active = {}
+        for name in SQLITE_PRAGMAS:
+            async with self.db.execute(f"PRAGMA {name}") as cursor:
+                active[name] = (await cursor.fetchone())[0]
+        self.logger.info(f"ShortTermStorage sqlite profile: {active}")
+        await self._add_tagesschau_primary_key()
+        await self.create_ttl_table("tagesschau", "id TEXT PRIMARY KEY, updated DATETIME")
+        await self.create_ttl_table("url_verdicts", "url TEXT PRIMARY KEY, unsafe BOOLEAN")
         self.logger.debug("ShortTermStorage set up!")
 
+    async def create_ttl_table(self, name: str, columns: str):
+        """Creates a table with the given columns and an indexed ``expires DATETIME`` column.
+        Rows of the table are removed by ``purge_expired`` once they expired"""
+        async with self.db.cursor() as cursor:
+            await cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} ({columns}, expires DATETIME)")
+            await cursor.execute(f"CREATE INDEX IF NOT EXISTS ix_{name}_expires ON {name} (expires)")
+        await self.db.commit()
+        self.ttl_tables.add(name)
+
+    async def purge_expired(self) -> dict[str, int]:
+        """Deletes all expired rows of every table created with ``create_ttl_table``.
+        Returns the amount of deleted rows per table"""
+        removed = {}
+        async with self.db.cursor() as cursor:
+            for table in sorted(self.ttl_tables):
+                await cursor.execute(f"DELETE FROM {table} WHERE expires < ?", (datetime.now(),))
+                removed[table] = cursor.rowcount
+        await self.db.commit()
+        return removed
+
+    async def _add_tagesschau_primary_key(self):
+        """Rebuilds tagesschau tables created without a primary key on id. The latest expiring row of an id is kept"""
+        async with self.db.execute("PRAGMA table_info(tagesschau)") as cursor:
+            columns = await cursor.fetchall()
+        if not columns or any(column[1] == "id" and column[5] for column in columns):
+            return
+        await self.db.executescript(
+            """
+            BEGIN;
+            CREATE TABLE tagesschau_new (id TEXT PRIMARY KEY, updated DATETIME, expires DATETIME);
+            INSERT OR REPLACE INTO tagesschau_new (id, updated, expires)
+                SELECT id, updated, expires FROM tagesschau ORDER BY expires;
+            DROP TABLE tagesschau;
+            ALTER TABLE tagesschau_new RENAME TO tagesschau;
+            COMMIT;
+            """
+        )
+        self.logger.info("Added a primary key to the tagesschau table")
+
+    async def optimize(self) -> tuple[int, int, int]:
+        """Runs PRAGMA optimize and truncates the write-ahead log. Returns the result of the checkpoint"""
+        await self.db.execute("PRAGMA optimize")
+        async with self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cursor:
+            return tuple(await cursor.fetchone())  # type: ignore
+
     async def close(self):
         await self.db.close()
 
     async def enter_tagesschau_id(self, uuid: str, updated: datetime, expires: datetime):
+        await self.enter_tagesschau_ids([(uuid, updated, expires)])
+
+    async def enter_tagesschau_ids(self, rows: list[tuple[str, datetime, datetime]]):
+        """Inserts or updates many rows of ID, Updated and Expires in one transaction"""
         async with self.db.cursor() as cursor:
-            await cursor.execute(
-                "INSERT INTO tagesschau (id, updated, expires) VALUES (?, ?, ?)", (uuid, updated, expires)
+            await cursor.executemany(
+                "INSERT INTO tagesschau (id, updated, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET updated = excluded.updated, expires = excluded.expires",
+                rows,
             )
         await self.db.commit()
 
     async def get_tagesschau_id(self, uuid: str):
         """Returns ID, Updated and Expires"""
+        return (await self.get_tagesschau_ids([uuid])).get(uuid)
+
+    async def get_tagesschau_ids(self, uuids: list[str]) -> dict[str, dict]:
+        """Returns ID, Updated and Expires for every given ID that is stored, keyed by ID"""
+        response = {}
         async with self.db.cursor() as cursor:
-            await cursor.execute("SELECT * FROM tagesschau WHERE id = ?", (uuid,))
-            resp = await cursor.fetchone()
-        if resp is None:
-            return None
-        else:
-            return {"id": uuid, "updated": resp[1], "expires": resp[2]}
+            for i in range(0, len(uuids), BATCH_SIZE):
+                chunk = uuids[i : i + BATCH_SIZE]
+                await cursor.execute(
+                    f"SELECT id, updated, expires FROM tagesschau WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                for resp in await cursor.fetchall():
+                    response[resp[0]] = {"id": resp[0], "updated": resp[1], "expires": resp[2]}
+        return response
 
     async def get_tagesschau_rows(self):
         """Returns first 50 entries ordered by expires: ID, Updated and Expires"""
@@ -74,6 +144,32 @@ class ShortTermStorage:
             return response
 
     async def delete_tagesschau_id(self, uuid: str):
+        await self.delete_tagesschau_ids([uuid])
+
+    async def delete_tagesschau_ids(self, uuids: list[str]):
+        """Deletes many IDs in one transaction"""
+        async with self.db.cursor() as cursor:
+            for i in range(0, len(uuids), BATCH_SIZE):
+                chunk = uuids[i : i + BATCH_SIZE]
+                await cursor.execute(f"DELETE FROM tagesschau WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        await self.db.commit()
+
+    async def enter_url_verdicts(self, rows: list[tuple[str, bool, datetime]]):
+        """Inserts or updates many rows of URL, Unsafe and Expires in one transaction"""
         async with self.db.cursor() as cursor:
-            await cursor.execute("DELETE FROM tagesschau WHERE id = ?", (uuid,))
+            await cursor.executemany(
+                "INSERT INTO url_verdicts (url, unsafe, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET unsafe = excluded.unsafe, expires = excluded.expires",
+                rows,
+            )
         await self.db.commit()
+
+    async def get_url_verdicts(self, limit: int) -> list[tuple[str, bool, datetime]]:
+        """Returns up to ``limit`` rows of URL, Unsafe and Expires that didn't expire, the latest expiring first"""
+        async with self.db.cursor() as cursor:
+            await cursor.execute(
+                "SELECT url, unsafe, expires FROM url_verdicts WHERE expires > ? ORDER BY expires DESC LIMIT ?",
+                (datetime.now(), limit),
+            )
+            rows = await cursor.fetchall()
+        return [(url, bool(unsafe), expires) for url, unsafe, expires in rows]
@@ -0,0 +1,123 @@
+from collections.abc import Iterable
+
+from .urls import canonicalize_url
+
+GLOBAL_RULES = 0  # the guild id of rules that apply to every guild
+
+
+def url_host(url: str) -> str:
+    """Returns the host of a canonical url"""
+    return url.split("/", 3)[2]
+
+
+def normalize_domain(value: str) -> str | None:
+    """
+    Returns the canonical host of a domain or url as entered by a user, or None if it isn't a domain.
+    "HTTPS://www.Example.com/path" becomes "www.example.com".
+    """
+    value = value.strip()
+    if not value:
+        return None
+    host = url_host(canonicalize_url(value))
+    if "." not in host or host.startswith("["):
+        return None
+    return host
+
+
+class _Node:
+    __slots__ = ("allowed", "children")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.allowed: bool | None = None  # the rule of the domain ending at this node, if there is one
+
+
+class DomainTrie:
+    """
+    A suffix trie over the reversed labels of domains, "com" -> "example" -> "www". A rule for a domain also applies
+    to all of its subdomains, the most specific rule wins. A match walks at most one node per label of the host.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, domain: str, allowed: bool) -> None:
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.children.setdefault(label, _Node())
+        if node.allowed is None:
+            self.size += 1
+        node.allowed = allowed
+
+    def remove(self, domain: str) -> bool:
+        """Removes the rule of a domain and prunes the nodes that are left without rules. Returns whether it existed"""
+        path = [self.root]
+        labels = list(reversed(domain.split(".")))
+        for label in labels:
+            node = path[-1].children.get(label)
+            if node is None:
+                return False
+            path.append(node)
+        if path[-1].allowed is None:
+            return False
+        path[-1].allowed = None
+        self.size -= 1
+        for label, parent, node in zip(reversed(labels), reversed(path[:-1]), reversed(path[1:]), strict=True):
+            if node.children or node.allowed is not None:
+                break
+            del parent.children[label]
+        return True
+
+    def match(self, host: str) -> bool | None:
+        """Returns whether the host is allowed (True) or denied (False) by the most specific rule, None without rule"""
+        node = self.root
+        allowed = None
+        for label in reversed(host.split(".")):
+            node = node.children.get(label)  # type: ignore
+            if node is None:
+                break
+            if node.allowed is not None:
+                allowed = node.allowed
+        return allowed
+
+
+class DomainRules:
+    """
+    The allow and deny lists of all guilds and the global lists, one ``DomainTrie`` per guild.
+    Rules of the guild take precedence over global rules, so a guild can allow a domain that is denied globally.
+    """
+
+    def __init__(self):
+        self.tries: dict[int, DomainTrie] = {}
+        self.hits = 0  # urls decided by a rule, without a safe browsing lookup
+
+    def __len__(self):
+        return sum(len(trie) for trie in self.tries.values())
+
+    def load(self, rules: Iterable[tuple[int, str, bool]]) -> None:
+        """Replaces all rules with (guild id, domain, allowed) rows"""
+        self.tries = {}
+        for guild_id, domain, allowed in rules:
+            self.add(guild_id, domain, allowed)
+
+    def add(self, guild_id: int, domain: str, allowed: bool) -> None:
+        self.tries.setdefault(guild_id, DomainTrie()).add(domain, allowed)
+
+    def remove(self, guild_id: int, domain: str) -> bool:
+        trie = self.tries.get(guild_id)
+        return trie is not None and trie.remove(domain)
+
+    def match(self, guild_id: int, host: str) -> bool | None:
+        """Returns whether the host is allowed (True) or denied (False) in a guild, None if no rule applies"""
+        for trie_id in (guild_id, GLOBAL_RULES):
+            trie = self.tries.get(trie_id)
+            if trie is not None:
+                allowed = trie.match(host)
+                if allowed is not None:
+                    self.hits += 1
+                    return allowed
+        return None
@@ -34,6 +34,14 @@ class StatTypeEnum(Enum):
     VoiceTime = "VoiceTime"
 
 
+class StatPeriodEnum(Enum):
+    """The periods older user stats are rolled up into, see ``ORMDataBase.compact_user_stats``"""
+
+    Week = "week"
+    Month = "month"
+    All = "all"
+
+
 class WebhookType(Enum):
     Tagesschau = "Tagesschau"
     Modmail = "Modmail"
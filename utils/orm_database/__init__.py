@@ -6,10 +6,16 @@ from .models import (
     Join2Create,
     Modmail,
     UserStats,
+    UserStatsRollup,
+    UserTotals,
+    LeaderboardEntry,
     BotStatus,
     EnabledCommands,
     Events,
     ConfirmationDB,
+    Webhooks,
+    DomainRules,
+    SchemaMigrations,
 )
 
 __all__ = [
@@ -20,8 +26,14 @@ __all__ = [
     "Join2Create",
     "Modmail",
     "UserStats",
+    "UserStatsRollup",
+    "UserTotals",
+    "LeaderboardEntry",
     "BotStatus",
     "EnabledCommands",
     "Events",
     "ConfirmationDB",
+    "Webhooks",
+    "DomainRules",
+    "SchemaMigrations",
 ]
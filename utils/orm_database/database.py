@@ -2,7 +2,9 @@ from collections.abc import Sequence
 from datetime import datetime, timedelta, date
 
 import discord
-from sqlalchemy import select, and_, func, delete
+from sqlalchemy import select, and_, func, delete, event, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
@@ -11,10 +13,19 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 
-from config import DATABASE_URL, SERVER_TZ
+from config import (
+    DATABASE_URL,
+    LEADERBOARD_SIZE,
+    SERVER_TZ,
+    STAT_BUFFER_SIZE,
+    USERSTATS_DAY_HORIZON,
+    USERSTATS_MONTH_HORIZON,
+    USERSTATS_WEEK_HORIZON,
+)
 
-from ..enums import InfractionsEnum, SettingsEnum, StatTypeEnum
+from ..enums import InfractionsEnum, SettingsEnum, StatPeriodEnum, StatTypeEnum
 from ..logger import CustomLogger
+from ..sqlite_profile import SQLITE_PRAGMAS, apply_pragmas
 from .models import (
     Base,
     BotStatus,
@@ -23,11 +34,34 @@ from .models import (
     Modmail,
     Settings,
     UserStats,
+    UserStatsRollup,
+    UserTotals,
+    TOTAL_COLUMNS,
     EnabledCommands,
     Events,
     ConfirmationDB,
+    Webhooks,
+    DomainRules,
 )
 from ..classes import Event, Confirmation
+from .leaderboard import Leaderboard
+from .migrations import migrate
+from .stat_buffer import StatKey, UserStatBuffer
+
+UPSERT_CHUNK_SIZE = 500  # rows per upsert statement, keeps SQLite below its bound parameter limit
+
+
+def _week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _months_back(day: date, months: int) -> date:
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    return date(year, month + 1, 1)
 
 
 class ORMDataBase:
@@ -41,11 +75,20 @@ class ORMDataBase:
         """
         self.logger: CustomLogger = None  # type: ignore
         self.engine: AsyncEngine = create_async_engine(DATABASE_URL)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine.sync_engine, "connect", apply_pragmas)
         self.AsyncSessionLocal: AsyncSession = async_sessionmaker(self.engine, expire_on_commit=False)  # type: ignore
+        self.stat_buffer = UserStatBuffer(self, max_size=STAT_BUFFER_SIZE)
+        self.leaderboard = Leaderboard(self, size=LEADERBOARD_SIZE)
+        self._settings_cache: dict[tuple[int, str], list[Settings]] = {}  # (guild_id, setting) -> rows
+        self._settings_cache_warm = False
+        self.settings_cache_hits = 0
+        self.settings_cache_misses = 0
+        self._disabled_commands: dict[int, set[str]] = {}  # guild_id -> qualified names of disabled commands
 
     async def setup(self, boot: datetime):
         """
-        Sets up the database by creating new tables if they don't already exist.
+        Sets up the database by creating new tables if they don't already exist and applying pending migrations.
 
         Args:
             boot (datetime): The boot time of the application.
@@ -54,19 +97,70 @@ class ORMDataBase:
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
             self.logger.info("ContentDB tables created and ready to use!")
+            if self.engine.dialect.name == "sqlite":
+                active = {name: (await conn.exec_driver_sql(f"PRAGMA {name}")).scalar() for name in SQLITE_PRAGMAS}
+                self.logger.info(f"ContentDB sqlite profile: {active}")
+        # create_all only creates missing tables, changes to existing ones are shipped as migrations
+        await migrate(self.engine, self.logger)
+        await self._warm_settings_cache()
+        await self._warm_command_cache()
+        await self.leaderboard.load()
+
+    async def optimize(self) -> tuple[int, int, int] | None:
+        """
+        Runs PRAGMA optimize and truncates the write-ahead log. Only does something on sqlite.
+
+        Returns: The result of the checkpoint (busy, log frames, checkpointed frames) or None on other dialects.
+        """
+        if self.engine.dialect.name != "sqlite":
+            return None
+        async with self.engine.connect() as conn:
+            await conn.exec_driver_sql("PRAGMA optimize")
+            result = (await conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")).one()
+        return tuple(result)  # type: ignore
 
     async def close(self):
         """
-        Closes the database connection and disposes of the engine.
+        Flushes the buffered user stats, persists the leaderboards, closes the database connection and disposes of the
+        engine. A failing flush is logged, the engine is disposed regardless.
         """
+        for write in (self.stat_buffer.flush, self.leaderboard.persist):
+            try:
+                await write()
+            except Exception as e:
+                self.logger.error(f"{write.__qualname__} failed while closing the database", exc_info=e)
+        self.logger.info(f"Settings cache: {self.settings_cache_info()}")
         self.logger.warning("Closing database connection")
         await self.engine.dispose()
 
+    async def _warm_settings_cache(self) -> None:
+        """
+        Loads the whole settings table into the settings cache.
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                results = (await session.execute(select(Settings))).scalars().all()
+        self._settings_cache.clear()
+        for result in results:
+            self._settings_cache.setdefault((result.guild, result.setting), []).append(result)
+        self._settings_cache_warm = True
+        self.logger.debug(f"Loaded {len(results)} settings into the cache")
+
+    def settings_cache_info(self) -> dict[str, int]:
+        """
+        Returns the hit and miss counters and the amount of cached (guild, setting) pairs of the settings cache.
+        """
+        return {
+            "hits": self.settings_cache_hits,
+            "misses": self.settings_cache_misses,
+            "size": len(self._settings_cache),
+        }
+
     async def get_setting(
         self, setting: SettingsEnum, guild: discord.Guild | None
     ) -> None | Settings | Sequence[Settings]:
         """
-        Retrieves a setting from the database.
+        Retrieves a setting from the settings cache, reading through to the database on a miss.
 
         Args:
             setting (SettingsEnum): The setting to retrieve.
@@ -75,24 +169,36 @@ class ORMDataBase:
         Returns:
             Sequence[Settings] | None: The retrieved setting(s) or None if not found.
         """
-        async with self.AsyncSessionLocal() as session:
-            async with session.begin():
-                if guild is None:
-                    query = select(Settings).where(Settings.setting == setting.value)
-                else:
-                    query = select(Settings).where(Settings.setting == setting.value, Settings.guild == guild.id)
-                response = await session.execute(query)
-                results = response.scalars().fetchall()
+        if guild is None and self._settings_cache_warm:
+            self.settings_cache_hits += 1
+            results = [row for (_, name), rows in self._settings_cache.items() if name == setting.value for row in rows]
+        elif guild is not None and (guild.id, setting.value) in self._settings_cache:
+            self.settings_cache_hits += 1
+            results = self._settings_cache[(guild.id, setting.value)]
+        else:
+            self.settings_cache_misses += 1
+            async with self.AsyncSessionLocal() as session:
+                async with session.begin():
+                    if guild is None:
+                        query = select(Settings).where(Settings.setting == setting.value)
+                    else:
+                        query = select(Settings).where(Settings.setting == setting.value, Settings.guild == guild.id)
+                    response = await session.execute(query)
+                    results = list(response.scalars().fetchall())
+            if guild is not None:
+                # also caches settings that aren't set. setdefault, an update or delete that ran while the query was
+                # awaited already stored the fresh value and must not be overwritten with this result
+                results = self._settings_cache.setdefault((guild.id, setting.value), results)
         if not results:
             return None
         elif len(results) == 1:
             return results[0]
         else:
-            return results
+            return list(results)
 
     async def update_setting(self, setting: SettingsEnum, value: int, guild: discord.Guild) -> None:
         """
-        Updates a setting in the database.
+        Updates a setting in the database and the settings cache.
 
         Args:
             setting (SettingsEnum): The setting to update.
@@ -104,19 +210,22 @@ class ORMDataBase:
                 query = select(Settings).where(Settings.setting == setting.value, Settings.guild == guild.id)
                 db_setting = (await session.execute(query)).scalar_one_or_none()
                 if db_setting is None:
-                    session.add(Settings(setting=setting.value, value=value, guild=guild.id))
+                    db_setting = Settings(setting=setting.value, value=value, guild=guild.id)
+                    session.add(db_setting)
                 else:
                     db_setting.value = value
             await session.commit()
+        self._settings_cache[(guild.id, setting.value)] = [db_setting]
 
     async def delete_setting(self, setting: SettingsEnum, guild: discord.Guild) -> None:
         """
-        Deletes a setting from the database.
+        Deletes a setting from the database and the settings cache.
 
         Args:
             setting (SettingsEnum): The setting to delete.
             guild (discord.Guild): The guild associated with the setting.
         """
+        self._settings_cache[(guild.id, setting.value)] = []
         async with self.AsyncSessionLocal() as session:
             async with session.begin():
                 query = select(Settings).where(Settings.setting == setting.value, Settings.guild == guild.id)
@@ -127,6 +236,102 @@ class ORMDataBase:
                     await session.delete(db_setting)
                 await session.commit()
 
+    async def get_webhooks(self) -> Sequence[Webhooks]:
+        """
+        Retrieves all stored webhooks.
+
+        Returns:
+            Sequence[Webhooks]: Every webhook the bot created or found in a channel.
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                return (await session.execute(select(Webhooks))).scalars().all()
+
+    async def set_webhook(self, guild_id: int, channel_id: int, webhook_id: int, token: str) -> None:
+        """
+        Stores the webhook of a channel, replacing a previously stored one.
+
+        Args:
+            guild_id (int): The guild of the channel.
+            channel_id (int): The channel the webhook posts to.
+            webhook_id (int): The id of the webhook.
+            token (str): The token of the webhook.
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                await session.merge(
+                    Webhooks(channel_id=channel_id, guild_id=guild_id, webhook_id=webhook_id, token=token)
+                )
+
+    async def delete_webhooks(self, *, channel_id: int | None = None, guild_id: int | None = None) -> None:
+        """
+        Deletes the stored webhook of a channel or all stored webhooks of a guild.
+
+        Args:
+            channel_id (int | None): The channel to delete the webhook for.
+            guild_id (int | None): The guild to delete all webhooks for. Used if channel_id is None.
+
+        Raises:
+            LookupError: If both channel_id and guild_id are None.
+        """
+        if channel_id is not None:
+            query = delete(Webhooks).where(Webhooks.channel_id == channel_id)
+        elif guild_id is not None:
+            query = delete(Webhooks).where(Webhooks.guild_id == guild_id)
+        else:
+            raise LookupError("Both arguments are 'None'. At least one must have a value!")
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                await session.execute(query)
+
+    async def get_domain_rules(self, guild_id: int | None = None) -> Sequence[DomainRules]:
+        """
+        Retrieves the domain rules of a guild or all domain rules.
+
+        Args:
+            guild_id (int | None): The guild to get the rules for, 0 for the global rules. None returns every rule.
+
+        Returns:
+            Sequence[DomainRules]: The rules, sorted by domain.
+        """
+        query = select(DomainRules).order_by(DomainRules.domain)
+        if guild_id is not None:
+            query = query.where(DomainRules.guild_id == guild_id)
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                return (await session.execute(query)).scalars().all()
+
+    async def set_domain_rule(self, guild_id: int, domain: str, allowed: bool) -> None:
+        """
+        Allows or denies a domain and its subdomains, replacing a previous rule for the domain.
+
+        Args:
+            guild_id (int): The guild the rule applies to, 0 for all guilds.
+            domain (str): The normalized domain.
+            allowed (bool): Whether the domain is allowed or denied.
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                await session.merge(DomainRules(guild_id=guild_id, domain=domain, allowed=allowed))
+
+    async def delete_domain_rule(self, guild_id: int, domain: str) -> bool:
+        """
+        Deletes the rule of a domain.
+
+        Args:
+            guild_id (int): The guild the rule applies to, 0 for all guilds.
+            domain (str): The normalized domain.
+
+        Returns:
+            bool: Whether a rule was deleted.
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                result = await session.execute(
+                    delete(DomainRules).where(DomainRules.guild_id == guild_id, DomainRules.domain == domain)
+                )
+                return result.rowcount > 0
+
     async def create_temp_voice(self, channel: discord.VoiceChannel, owner: discord.Member) -> Join2Create | None:
         async with self.AsyncSessionLocal() as session:
             async with session.begin():
@@ -167,7 +372,7 @@ class ORMDataBase:
         self, user: discord.User | discord.Member, infraction: InfractionsEnum, reason: str, guild: discord.Guild
     ) -> int:
         """
-        Creates a new infraction record in the database.
+        Creates a new infraction record in the database and counts it in the user's totals.
 
         Args:
             user (discord.User | discord.Member): The user who received the infraction.
@@ -184,6 +389,7 @@ class ORMDataBase:
                     user_id=user.id, infraction=infraction.value, reason=reason, date=datetime.now(), guild=guild.id
                 )
                 session.add(infraction)
+                await self._add_user_totals(session, {(guild.id, user.id): {"infractions": 1}})
                 await session.commit()
                 return infraction.case_id
 
@@ -270,34 +476,160 @@ class ORMDataBase:
         :param guild: the guild associated with the stat
         :return: ``None``
         """
-        today = datetime.today()
+        await self.update_user_stats({(guild.id, user.id, stat_type.value, date.today()): value})
+
+    async def buffer_user_stat(
+        self, user: discord.User | discord.Member, stat_type: StatTypeEnum, value: int, guild: discord.Guild
+    ) -> None:
+        """
+        Adds a stat for the user to the write-behind buffer. It is written to the database on the next flush.
+        :param user: the user to add the stat for
+        :param stat_type: the Stat type to update
+        :param value: the value to add
+        :param guild: the guild associated with the stat
+        :return: ``None``
+        """
+        await self.stat_buffer.add(guild.id, user.id, stat_type, value)
+
+    async def update_user_stats(self, stats: dict[StatKey, int]) -> None:
+        """
+        Adds many stats at once. Creates the rows for new days if necessary, adds the stats to the user totals and
+        feeds the leaderboards.
+        SQLite and PostgreSQL use ``INSERT ... ON CONFLICT DO UPDATE`` with up to ``UPSERT_CHUNK_SIZE`` rows per
+        statement, other dialects fall back to a read-then-write per row. Everything happens in one transaction.
+        :param stats: a mapping of ``(guild_id, user_id, stat_type, day)`` to the value to add
+        :return: ``None``
+        """
+        if not stats:
+            return
+        if self.engine.dialect.name == "sqlite":
+            insert = sqlite_insert
+        elif self.engine.dialect.name == "postgresql":
+            insert = postgresql_insert
+        else:
+            return await self._update_user_stats_fallback(stats)
+        rows = [
+            {"guild_id": guild_id, "user_id": user_id, "stat_type": stat_type, "day": day, "value": value}
+            for (guild_id, user_id, stat_type, day), value in stats.items()
+        ]
         async with self.AsyncSessionLocal() as session:
             async with session.begin():
-                query = select(UserStats).where(
-                    and_(
-                        UserStats.user_id == user.id,
-                        UserStats.stat_type == stat_type.value,
-                        UserStats.guild_id == guild.id,
+                for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                    query = insert(UserStats).values(rows[i : i + UPSERT_CHUNK_SIZE])
+                    query = query.on_conflict_do_update(
+                        index_elements=[UserStats.user_id, UserStats.guild_id, UserStats.stat_type, UserStats.day],
+                        set_={"value": UserStats.value + query.excluded.value},
                     )
-                )
-                result: UserStats | None = (await session.execute(query)).scalar_one_or_none()
-                if result is None:
-                    new_stat = UserStats(
-                        user_id=user.id,
-                        stat_type=stat_type.value,
-                        value=value,
-                        guild_id=guild.id,
-                        day=today,
+                    await session.execute(query)
+                totals = await self._add_user_totals(session, self._stat_totals(stats))
+        self.leaderboard.add(stats, totals)
+
+    async def _update_user_stats_fallback(self, stats: dict[StatKey, int]) -> None:
+        """
+        Read-then-write variant of ``update_user_stats`` for dialects without ``ON CONFLICT`` support.
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                for (guild_id, user_id, stat_type, day), value in stats.items():
+                    query = select(UserStats).where(
+                        and_(
+                            UserStats.user_id == user_id,
+                            UserStats.stat_type == stat_type,
+                            UserStats.guild_id == guild_id,
+                            UserStats.day == day,
+                        )
                     )
-                    session.add(new_stat)
-                else:
-                    result.value += value
+                    result: UserStats | None = (await session.execute(query)).scalar_one_or_none()
+                    if result is None:
+                        session.add(
+                            UserStats(user_id=user_id, stat_type=stat_type, value=value, guild_id=guild_id, day=day)
+                        )
+                    else:
+                        result.value += value
+                totals = await self._add_user_totals(session, self._stat_totals(stats))
+        self.leaderboard.add(stats, totals)
+
+    @staticmethod
+    def _stat_totals(stats: dict[StatKey, int]) -> dict[tuple[int, int], dict[str, int]]:
+        """
+        Sums stats per (guild_id, user_id) into the columns of the usertotals table.
+        """
+        totals: dict[tuple[int, int], dict[str, int]] = {}
+        for (guild_id, user_id, stat_type, _), value in stats.items():
+            if stat_type not in TOTAL_COLUMNS:
+                continue
+            columns = totals.setdefault((guild_id, user_id), {})
+            columns[TOTAL_COLUMNS[stat_type]] = columns.get(TOTAL_COLUMNS[stat_type], 0) + value
+        return totals
+
+    async def _add_user_totals(
+        self, session: AsyncSession, totals: dict[tuple[int, int], dict[str, int]]
+    ) -> dict[tuple[int, int], dict[str, int]]:
+        """
+        Adds values to the totals of users, creating the rows if necessary. Runs in the transaction of ``session``.
+        :param session: the session of the write the totals belong to
+        :param totals: a mapping of ``(guild_id, user_id)`` to the values to add per usertotals column
+        :return: the new stat totals of the updated users, keyed like ``totals``
+        """
+        columns = ("voice_time", "messages_sent", "commands_used", "infractions")
+        rows = [
+            {"guild_id": guild_id, "user_id": user_id, **{column: values.get(column, 0) for column in columns}}
+            for (guild_id, user_id), values in totals.items()
+        ]
+        new_totals: dict[tuple[int, int], dict[str, int]] = {}
+        if not rows:
+            return new_totals
+        stat_columns = tuple(TOTAL_COLUMNS.values())
+        if self.engine.dialect.name in ("sqlite", "postgresql"):
+            insert = sqlite_insert if self.engine.dialect.name == "sqlite" else postgresql_insert
+            for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                query = insert(UserTotals).values(rows[i : i + UPSERT_CHUNK_SIZE])
+                query = query.on_conflict_do_update(
+                    index_elements=[UserTotals.guild_id, UserTotals.user_id],
+                    set_={column: getattr(UserTotals, column) + query.excluded[column] for column in columns},
+                ).returning(UserTotals.guild_id, UserTotals.user_id, *(getattr(UserTotals, c) for c in stat_columns))
+                for guild_id, user_id, *values in await session.execute(query):
+                    new_totals[(guild_id, user_id)] = dict(zip(stat_columns, values))
+            return new_totals
+        for row in rows:
+            result: UserTotals | None = await session.get(UserTotals, (row["guild_id"], row["user_id"]))
+            if result is None:
+                result = UserTotals(**row)
+                session.add(result)
+            else:
+                for column in columns:
+                    setattr(result, column, getattr(result, column) + row[column])
+            new_totals[(row["guild_id"], row["user_id"])] = {column: getattr(result, column) for column in stat_columns}
+        return new_totals
+
+    async def get_user_totals(self, user: discord.User | discord.Member, guild: discord.Guild) -> UserTotals | None:
+        """
+        Returns the all time totals of a user in a guild with a single primary key lookup.
+        :param user: the User to retrieve the totals for
+        :param guild: the specific guild to retrieve the totals for
+        :return: ``UserTotals`` or ``None`` if the user has no stats and infractions in the guild
+        """
+        async with self.AsyncSessionLocal() as session:
+            return await session.get(UserTotals, (guild.id, user.id))
+
+    def get_leaderboard(
+        self, guild: discord.Guild, stat_type: StatTypeEnum, period: StatPeriodEnum
+    ) -> list[tuple[int, int]]:
+        """
+        Returns the top users of a guild for a stat from the in-memory leaderboard, no query is made.
+        :param guild: the guild to get the leaderboard for
+        :param stat_type: the stat the users are ranked by
+        :param period: the current week, the current month or all time
+        :return: up to ``LEADERBOARD_SIZE`` tuples of ``(user_id, value)``, the highest value first
+        """
+        return self.leaderboard.top(guild.id, stat_type.value, period)
 
     async def get_user_stat_days(
         self, user: discord.User | discord.Member, stat_type: StatTypeEnum, guild: discord.Guild, days_back: int
     ) -> Sequence[UserStats]:
         """
-        Returns the stats for the specified date range
+        Returns the stats for the specified date range. Only days within ``USERSTATS_DAY_HORIZON`` are kept per day,
+        older days are rolled up by ``compact_user_stats``
         :param user: the User to retrieve the stats for
         :param stat_type: the type of stat to return
         :param guild: the specific guild to retrieve the stats for
@@ -325,18 +657,25 @@ class ORMDataBase:
         self, user: discord.User | discord.Member, stat_type: StatTypeEnum, guild: discord.Guild
     ) -> int:
         """
-        Returns an int consisting of all values this user has for the stat.
+        Returns an int consisting of all values this user has for the stat. Sums the day rows within the compaction
+        horizon and the rolled up weeks, months and all time row, so it touches a bounded number of rows.
         :param user: the User to retrieve the stats for
         :param stat_type: the type of stat to return
         :param guild: the specific guild to retrieve the stats for
         :return: ``int`` sum of the values
         """
-        async with self.AsyncSessionLocal() as session:
-            query = select(func.sum(UserStats.value)).where(
-                and_(
-                    UserStats.user_id == user.id, UserStats.stat_type == stat_type.value, UserStats.guild_id == guild.id
-                )
+        raw = select(func.coalesce(func.sum(UserStats.value), 0)).where(
+            and_(UserStats.user_id == user.id, UserStats.stat_type == stat_type.value, UserStats.guild_id == guild.id)
+        )
+        rolled_up = select(func.coalesce(func.sum(UserStatsRollup.value), 0)).where(
+            and_(
+                UserStatsRollup.user_id == user.id,
+                UserStatsRollup.stat_type == stat_type.value,
+                UserStatsRollup.guild_id == guild.id,
             )
+        )
+        async with self.AsyncSessionLocal() as session:
+            query = select(raw.scalar_subquery() + rolled_up.scalar_subquery())
             result = (await session.execute(query)).scalar_one_or_none()
             return result or 0
 
@@ -344,12 +683,15 @@ class ORMDataBase:
         self, user: discord.User | discord.Member | None, stat_type: StatTypeEnum, guild: discord.Guild | None
     ) -> None:
         """
-        Deletes all stats of a user for a specific stat type and guild.
+        Deletes all stats of a user for a specific stat type and guild, including the rolled up ones, the total and
+        the leaderboard entries.
         :param user: the User to delete the stats for
         :param stat_type: the type of stat to delete
         :param guild: the specific guild to delete the stats for
         :return: ``None``
         """
+        # buffered increments would be written back by the next flush and bring the deleted stats back
+        await self.stat_buffer.discard(stat_type, user.id if user else None, guild.id if guild else None)
         async with self.AsyncSessionLocal() as session:
             async with session.begin():
                 if user and guild:
@@ -374,7 +716,138 @@ class ORMDataBase:
                 result = (await session.execute(query)).scalars().all()
                 for stat in result:
                     await session.delete(stat)
+                rollup_query = delete(UserStatsRollup).where(UserStatsRollup.stat_type == stat_type.value)
+                if user:
+                    rollup_query = rollup_query.where(UserStatsRollup.user_id == user.id)
+                if guild:
+                    rollup_query = rollup_query.where(UserStatsRollup.guild_id == guild.id)
+                await session.execute(rollup_query)
+                if stat_type.value in TOTAL_COLUMNS:
+                    totals_query = update(UserTotals).values({TOTAL_COLUMNS[stat_type.value]: 0})
+                    if user:
+                        totals_query = totals_query.where(UserTotals.user_id == user.id)
+                    if guild:
+                        totals_query = totals_query.where(UserTotals.guild_id == guild.id)
+                    await session.execute(totals_query)
                 await session.commit()
+        self.leaderboard.forget(stat_type.value, user.id if user else None, guild.id if guild else None)
+
+    async def compact_user_stats(self, today: date | None = None) -> dict[str, int]:
+        """
+        Rolls day rows older than ``USERSTATS_DAY_HORIZON`` days up into weeks, weeks older than
+        ``USERSTATS_WEEK_HORIZON`` weeks into months and months older than ``USERSTATS_MONTH_HORIZON`` months into one
+        all time row. Only complete weeks and months are rolled up; a week counts to the month it starts in.
+        Every step runs in one transaction that adds the sums to the rollup rows and deletes the rolled up rows.
+
+        Args:
+            today: The day the horizons are counted from. Defaults to today.
+
+        Returns: The amount of rolled up rows per period they came from ("day", "week", "month").
+        """
+        today = today or date.today()
+        day_cutoff = _week_start(today - timedelta(days=USERSTATS_DAY_HORIZON))
+        week_cutoff = _month_start(today - timedelta(weeks=USERSTATS_WEEK_HORIZON))
+        month_cutoff = _months_back(today, USERSTATS_MONTH_HORIZON)
+        weeks = and_(UserStatsRollup.period == StatPeriodEnum.Week.value, UserStatsRollup.period_start < week_cutoff)
+        months = and_(UserStatsRollup.period == StatPeriodEnum.Month.value, UserStatsRollup.period_start < month_cutoff)
+        rollup_columns = (
+            UserStatsRollup.guild_id,
+            UserStatsRollup.user_id,
+            UserStatsRollup.stat_type,
+            UserStatsRollup.period_start,
+            UserStatsRollup.value,
+        )
+        return {
+            "day": await self._roll_up(
+                select(
+                    UserStats.guild_id, UserStats.user_id, UserStats.stat_type, UserStats.day, UserStats.value
+                ).where(UserStats.day < day_cutoff),
+                delete(UserStats).where(UserStats.day < day_cutoff),
+                StatPeriodEnum.Week,
+                _week_start,
+            ),
+            "week": await self._roll_up(
+                select(*rollup_columns).where(weeks),
+                delete(UserStatsRollup).where(weeks),
+                StatPeriodEnum.Month,
+                _month_start,
+            ),
+            "month": await self._roll_up(
+                select(*rollup_columns).where(months),
+                delete(UserStatsRollup).where(months),
+                StatPeriodEnum.All,
+                lambda _: date.min,
+            ),
+        }
+
+    async def _roll_up(self, source, remove, period: StatPeriodEnum, period_start) -> int:
+        """
+        Sums the rows of ``source`` per (guild_id, user_id, stat_type, period_start(day)), adds them to the rollup rows
+        of ``period`` and executes ``remove``. ``source`` has to select guild_id, user_id, stat_type, day and value.
+
+        Returns: The amount of rolled up rows.
+        """
+        sums: dict[tuple[int, int, str, date], int] = {}
+        count = 0
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                async for guild_id, user_id, stat_type, day, value in await session.stream(source):
+                    key = (guild_id, user_id, stat_type, period_start(day))
+                    sums[key] = sums.get(key, 0) + (value or 0)
+                    count += 1
+                if not count:
+                    return 0
+                rows = [
+                    {
+                        "guild_id": guild_id,
+                        "user_id": user_id,
+                        "stat_type": stat_type,
+                        "period": period.value,
+                        "period_start": start,
+                        "value": value,
+                    }
+                    for (guild_id, user_id, stat_type, start), value in sums.items()
+                ]
+                await self._add_user_stat_rollups(session, rows)
+                await session.execute(remove)
+        self.logger.debug(f"Rolled {count} user stat rows up into {len(sums)} {period.value} rows")
+        return count
+
+    async def _add_user_stat_rollups(self, session: AsyncSession, rows: list[dict]) -> None:
+        """
+        Adds the values of ``rows`` to the existing rollup rows or creates them, like ``update_user_stats``.
+        """
+        if self.engine.dialect.name in ("sqlite", "postgresql"):
+            insert = sqlite_insert if self.engine.dialect.name == "sqlite" else postgresql_insert
+            for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                query = insert(UserStatsRollup).values(rows[i : i + UPSERT_CHUNK_SIZE])
+                query = query.on_conflict_do_update(
+                    index_elements=[
+                        UserStatsRollup.user_id,
+                        UserStatsRollup.guild_id,
+                        UserStatsRollup.stat_type,
+                        UserStatsRollup.period,
+                        UserStatsRollup.period_start,
+                    ],
+                    set_={"value": UserStatsRollup.value + query.excluded.value},
+                )
+                await session.execute(query)
+            return
+        for row in rows:
+            query = select(UserStatsRollup).where(
+                and_(
+                    UserStatsRollup.user_id == row["user_id"],
+                    UserStatsRollup.guild_id == row["guild_id"],
+                    UserStatsRollup.stat_type == row["stat_type"],
+                    UserStatsRollup.period == row["period"],
+                    UserStatsRollup.period_start == row["period_start"],
+                )
+            )
+            result: UserStatsRollup | None = (await session.execute(query)).scalar_one_or_none()
+            if result is None:
+                session.add(UserStatsRollup(**row))
+            else:
+                result.value += row["value"]
 
     async def create_bot_status(self, activity_type: discord.ActivityType, status: discord.Status, activity_name: str):
         async with self.AsyncSessionLocal() as session:
@@ -435,9 +908,24 @@ class ORMDataBase:
                 await session.delete(result)
                 await session.commit()
 
+    async def _warm_command_cache(self) -> None:
+        """
+        Loads all disabled commands of every guild into memory. Commands without a record are enabled.
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                query = select(EnabledCommands.guild_id, EnabledCommands.command_name).where(
+                    EnabledCommands.enabled.is_(False)
+                )
+                results = (await session.execute(query)).all()
+        self._disabled_commands.clear()
+        for guild_id, command_name in results:
+            self._disabled_commands.setdefault(guild_id, set()).add(command_name)
+        self.logger.debug(f"Loaded {len(results)} disabled commands into the cache")
+
     async def is_command_enabled(self, guild: discord.Guild, command_name: str) -> bool:
         """
-        Checks if a specific command is enabled for a given guild.
+        Checks if a specific command is enabled for a given guild. This is answered from memory.
 
         Args:
             guild: The Discord guild to check the command status for.
@@ -447,15 +935,22 @@ class ORMDataBase:
             True if the command is enabled for the guild, or if no record exists (default enabled).
             False if the command is explicitly disabled.
         """
-        async with self.AsyncSessionLocal() as session:
-            async with session.begin():
-                query = select(EnabledCommands).where(
-                    EnabledCommands.guild_id == guild.id, EnabledCommands.command_name == command_name
-                )
-                result: EnabledCommands | None = (await session.execute(query)).scalar_one_or_none()
-                if result is None:
-                    return True
-                return bool(result.enabled)
+        disabled = self._disabled_commands.get(guild.id)
+        return disabled is None or command_name not in disabled
+
+    async def get_command_states(self, guild: discord.Guild, command_names: Sequence[str]) -> dict[str, bool]:
+        """
+        Checks for many commands at once if they are enabled for a given guild. This is answered from memory.
+
+        Args:
+            guild: The Discord guild to check the command states for.
+            command_names: The qualified names of the commands to check.
+
+        Returns:
+            A mapping of every given command name to whether it is enabled.
+        """
+        disabled = self._disabled_commands.get(guild.id, set())
+        return {name: name not in disabled for name in command_names}
 
     async def toggle_command(self, guild: discord.Guild, command_name: str) -> bool:
         """
@@ -481,7 +976,14 @@ class ORMDataBase:
                     result.enabled = not bool(result.enabled)
                     new_state = bool(result.enabled)
                 await session.commit()
-                return new_state
+        disabled = self._disabled_commands.setdefault(guild.id, set())
+        if new_state:
+            disabled.discard(command_name)
+            if not disabled:
+                del self._disabled_commands[guild.id]
+        else:
+            disabled.add(command_name)
+        return new_state
 
     async def create_confirmation(
         self, *, event_id: str, guest: int, confirmation: bool | None, reminders: list[int]
@@ -605,6 +1107,27 @@ class ORMDataBase:
                 res.append(new_conf)
             return res
 
+    async def get_complete_confirmations_for_events(self) -> dict[str, list[Confirmation]]:
+        """
+        Gets the confirmations of all users that accepted an invitation, for every event at once
+        Returns: A mapping of event ids to all confirmations that accepted the invitation
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                query = select(ConfirmationDB).where(ConfirmationDB.confirmation.is_(True))
+                confir: Sequence[ConfirmationDB] = (await session.execute(query)).scalars().all()
+        res: dict[str, list[Confirmation]] = {}
+        for conf in confir:
+            if conf.reminders == "":
+                reminders_t = []
+            else:
+                reminders_t = list(map(int, conf.reminders.split(",")))
+            new_conf = Confirmation(
+                event_id=conf.event_id, guest=conf.user_id, confirmation=conf.confirmation, reminders=reminders_t
+            )
+            res.setdefault(conf.event_id, []).append(new_conf)
+        return res
+
     async def get_all_confirmations_for_event(self, *, event_id: str) -> list[int]:
         """
         Gets all user that were invited to the event
@@ -671,10 +1194,13 @@ class ORMDataBase:
         async with self.AsyncSessionLocal() as session:
             async with session.begin():
                 event = await session.get(Events, id)
-                users = await self.get_confirmations_for_event(event_id=id)
-        if event is None:
-            self.logger.error(f"Event not found by id {id}")
-            return None
+                if event is None:
+                    self.logger.error(f"Event not found by id {id}")
+                    return None
+                query = select(ConfirmationDB.user_id).where(
+                    ConfirmationDB.event_id == id, ConfirmationDB.confirmation.is_(True)
+                )
+                users = list((await session.execute(query)).scalars().all())
         event_t = Event(
             id=event.id,
             host=event.host,
@@ -686,32 +1212,74 @@ class ORMDataBase:
 
         return event_t
 
-    async def get_events(self) -> list[Event]:
+    async def get_events(
+        self,
+        *,
+        host: int | None = None,
+        name: str | None = None,
+        after: datetime | None = None,
+        before: datetime | None = None,
+        mode: str | None = None,
+    ) -> list[Event]:
         """
-        Gets all events
+        Gets all events matching the given filters. The events and their confirmed guests are loaded with two queries.
         Args:
+            host: Only return events of this host.
+            name: Only return events with this name.
+            after: Only return events that happen at or after this time.
+            before: Only return events that happen before this time.
+            mode: Only return events with this invite mode.
 
         Returns:
             All events as a dict (so i dont have to rewrite the reminder logic ^^)
         """
+        conditions = []
+        if host is not None:
+            conditions.append(Events.host == host)
+        if name is not None:
+            conditions.append(Events.name == name)
+        if after is not None:
+            conditions.append(Events.time >= after)
+        if before is not None:
+            conditions.append(Events.time < before)
+        if mode is not None:
+            conditions.append(Events.mode == mode)
         async with self.AsyncSessionLocal() as session:
             async with session.begin():
-                query = select(Events)
-                events = (await session.execute(query)).scalars().all()
-        events_r = []
-        for event in events:
-            users = await self.get_confirmations_for_event(event_id=event.id)
-            event_t = Event(
+                events = (await session.execute(select(Events).where(*conditions))).scalars().all()
+                query = (
+                    select(ConfirmationDB.event_id, ConfirmationDB.user_id)
+                    .join(Events, Events.id == ConfirmationDB.event_id)
+                    .where(ConfirmationDB.confirmation.is_(True), *conditions)
+                )
+                confirmations = (await session.execute(query)).all()
+        users: dict[str, list[int]] = {}
+        for event_id, user_id in confirmations:
+            users.setdefault(event_id, []).append(user_id)
+        return [
+            Event(
                 id=event.id,
                 host=event.host,
                 name=event.name,
                 time=event.time,
-                invites=users,
+                invites=users.get(event.id, []),
                 mode=event.mode,
             )
+            for event in events
+        ]
 
-            events_r.append(event_t)
-        return events_r
+    async def get_event_ids_for_guest(self, *, guest: int) -> set[str]:
+        """
+        Gets the ids of all events a user was invited to
+        Args:
+            guest: ID of the user
+
+        Returns: The ids of all events the user was invited to, regardless of their answer
+        """
+        async with self.AsyncSessionLocal() as session:
+            async with session.begin():
+                query = select(ConfirmationDB.event_id).where(ConfirmationDB.user_id == guest)
+                return set((await session.execute(query)).scalars().all())
 
     async def update_event(
         self,
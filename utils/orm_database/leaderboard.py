@@ -0,0 +1,205 @@
+from bisect import insort
+from datetime import date, timedelta
+from typing import TYPE_CHECKING
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..enums import StatPeriodEnum
+from .models import TOTAL_COLUMNS, LeaderboardEntry, UserStats, UserTotals
+from .stat_buffer import StatKey
+
+if TYPE_CHECKING:
+    from .database import ORMDataBase
+
+BoardKey = tuple[int, str, StatPeriodEnum]  # (guild_id, stat_type, period)
+WINDOWS = (StatPeriodEnum.Week, StatPeriodEnum.Month)
+STAT_TYPES = {column: stat_type for stat_type, column in TOTAL_COLUMNS.items()}  # usertotals column -> stat type
+
+
+def period_start(period: StatPeriodEnum, day: date) -> date:
+    """Returns the first day of the period ``day`` is in"""
+    if period == StatPeriodEnum.Week:
+        return day - timedelta(days=day.weekday())
+    if period == StatPeriodEnum.Month:
+        return day.replace(day=1)
+    return date.min
+
+
+class TopK:
+    """The ``size`` highest scores of one leaderboard. Scores only grow, so a user below the board can't pass it
+    without being offered again."""
+
+    __slots__ = ("size", "entries")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: list[tuple[int, int]] = []  # (-score, user_id), ascending means the highest score first
+
+    def offer(self, user_id: int, score: int) -> None:
+        """Puts the new score of a user on the board if it's high enough"""
+        self.remove(user_id)
+        if len(self.entries) < self.size or -score < self.entries[-1][0]:
+            insort(self.entries, (-score, user_id))
+            del self.entries[self.size :]
+
+    def remove(self, user_id: int) -> None:
+        for i, (_, entry_user) in enumerate(self.entries):
+            if entry_user == user_id:
+                del self.entries[i]
+                return
+
+    def top(self) -> list[tuple[int, int]]:
+        """Returns (user_id, score) tuples, the highest score first"""
+        return [(user_id, -score) for score, user_id in self.entries]
+
+
+class Leaderboard:
+    """
+    Top-K leaderboards per (guild, stat_type, period), maintained from the stat write path of the database.
+    All time boards are fed with the new totals of the usertotals table. The current week and month are fed with the
+    written increments, their exact scores of every active user are kept in memory, so a user outside the board is
+    ranked correctly once they pass it. The boards are written to the leaderboard table by ``persist``.
+    """
+
+    def __init__(self, db: "ORMDataBase", size: int):
+        """
+        Args:
+            db: The database the boards are fed from and persisted to.
+            size: The amount of users per board.
+        """
+        self.db = db
+        self.size = size
+        self.boards: dict[BoardKey, TopK] = {}
+        self.window_scores: dict[BoardKey, dict[int, int]] = {}  # user_id -> score in the current week or month
+        self.window_starts: dict[StatPeriodEnum, date] = {}
+        self.dirty = False
+
+    def _board(self, key: BoardKey) -> TopK:
+        board = self.boards.get(key)
+        if board is None:
+            board = self.boards[key] = TopK(self.size)
+        return board
+
+    def _roll_windows(self, today: date) -> None:
+        """Drops the boards of a week or month that ended"""
+        for period in WINDOWS:
+            start = period_start(period, today)
+            if self.window_starts.get(period) == start:
+                continue
+            self.window_starts[period] = start
+            for key in [key for key in self.boards if key[2] == period]:
+                del self.boards[key]
+            for key in [key for key in self.window_scores if key[2] == period]:
+                del self.window_scores[key]
+            self.dirty = True
+
+    def _add_window_score(self, guild_id: int, user_id: int, stat_type: str, day: date, value: int) -> None:
+        for period in WINDOWS:
+            if day < self.window_starts[period]:
+                continue
+            key = (guild_id, stat_type, period)
+            scores = self.window_scores.setdefault(key, {})
+            scores[user_id] = scores.get(user_id, 0) + value
+            self._board(key).offer(user_id, scores[user_id])
+
+    def add(self, stats: dict[StatKey, int], totals: dict[tuple[int, int], dict[str, int]]) -> None:
+        """
+        Feeds written stats into the boards.
+        Args:
+            stats: The written increments, keyed by (guild_id, user_id, stat_type, day).
+            totals: The new usertotals columns of the written users, keyed by (guild_id, user_id).
+
+        Returns: None
+        """
+        self._roll_windows(date.today())
+        for (guild_id, user_id, stat_type, day), value in stats.items():
+            if stat_type in TOTAL_COLUMNS:
+                self._add_window_score(guild_id, user_id, stat_type, day, value)
+        for (guild_id, user_id), columns in totals.items():
+            for column, score in columns.items():
+                if score:  # like the rebuild in load, zero columns of the row (e.g. a deleted stat) rank nobody
+                    self._board((guild_id, STAT_TYPES[column], StatPeriodEnum.All)).offer(user_id, score)
+        self.dirty = True
+
+    def top(self, guild_id: int, stat_type: str, period: StatPeriodEnum) -> list[tuple[int, int]]:
+        """Returns up to ``size`` (user_id, score) tuples, the highest score first"""
+        self._roll_windows(date.today())
+        board = self.boards.get((guild_id, stat_type, period))
+        return board.top() if board else []
+
+    def forget(self, stat_type: str, user_id: int | None, guild_id: int | None) -> None:
+        """Removes deleted stats from the boards. Without a user the boards of the guild are dropped"""
+        for key in [key for key in self.boards if key[1] == stat_type and guild_id in (None, key[0])]:
+            if user_id is None:
+                del self.boards[key]
+                self.window_scores.pop(key, None)
+            else:
+                self.boards[key].remove(user_id)
+                self.window_scores.get(key, {}).pop(user_id, None)
+        self.dirty = True
+
+    async def load(self) -> None:
+        """
+        Loads the all time boards from the leaderboard table, or from the usertotals table if nothing was persisted yet.
+        The boards of the current week and month are rebuilt from the day rows of the userstats table.
+        """
+        today = date.today()
+        self._roll_windows(today)
+        async with self.db.AsyncSessionLocal() as session:
+            query = select(LeaderboardEntry).where(LeaderboardEntry.period == StatPeriodEnum.All.value)
+            entries = (await session.execute(query)).scalars().all()
+            for entry in entries:
+                self._board((entry.guild_id, entry.stat_type, StatPeriodEnum.All)).offer(entry.user_id, entry.value)
+            if not entries:
+                columns = [getattr(UserTotals, column) for column in STAT_TYPES]
+                async for guild_id, user_id, *values in await session.stream(
+                    select(UserTotals.guild_id, UserTotals.user_id, *columns)
+                ):
+                    for column, score in zip(STAT_TYPES, values):
+                        if score:
+                            self._board((guild_id, STAT_TYPES[column], StatPeriodEnum.All)).offer(user_id, score)
+            query = (
+                select(
+                    UserStats.guild_id, UserStats.user_id, UserStats.stat_type, UserStats.day, func.sum(UserStats.value)
+                )
+                .where(UserStats.day >= min(self.window_starts.values()), UserStats.stat_type.in_(TOTAL_COLUMNS))
+                .group_by(UserStats.guild_id, UserStats.user_id, UserStats.stat_type, UserStats.day)
+            )
+            async for guild_id, user_id, stat_type, day, value in await session.stream(query):
+                self._add_window_score(guild_id, user_id, stat_type, day, value or 0)
+        self.dirty = False
+        self.db.logger.info(f"Loaded {len(self.boards)} leaderboards")
+
+    async def persist(self) -> int:
+        """
+        Replaces the content of the leaderboard table with the current boards, if they changed since the last call.
+
+        Returns: The amount of written entries.
+        """
+        if not self.dirty:
+            return 0
+        self.dirty = False
+        rows = [
+            {
+                "guild_id": guild_id,
+                "stat_type": stat_type,
+                "period": period.value,
+                "rank": rank,
+                "period_start": self.window_starts.get(period, date.min),
+                "user_id": user_id,
+                "value": score,
+            }
+            for (guild_id, stat_type, period), board in self.boards.items()
+            for rank, (user_id, score) in enumerate(board.top(), start=1)
+        ]
+        try:
+            async with self.db.AsyncSessionLocal() as session:
+                async with session.begin():
+                    await session.execute(delete(LeaderboardEntry))
+                    if rows:
+                        await session.execute(insert(LeaderboardEntry), rows)
+        except SQLAlchemyError:
+            self.dirty = True  # retried with the next call
+            raise
+        return len(rows)
@@ -0,0 +1,140 @@
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+from sqlalchemy import Index, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateIndex
+
+from ..logger import CustomLogger
+from .models import (
+    ConfirmationDB,
+    Events,
+    Infractions,
+    Modmail,
+    SchemaMigrations,
+    Settings,
+    TOTAL_COLUMNS,
+    UserStats,
+    UserStatsRollup,
+    UserTotals,
+)
+
+Upgrade = Callable[[AsyncConnection], Awaitable[None]]
+
+
+class Migration:
+    """
+    A versioned change of the schema. Migrations are applied once, in the order of their version.
+    They have to be idempotent, a fresh database already got the latest schema from ``create_all``.
+    """
+
+    def __init__(self, version: int, name: str, upgrade: Upgrade, transactional: bool = True):
+        """
+        Args:
+            version: The unique version of the migration, migrations are applied in ascending order.
+            name: A short description that ends up in the log and the schema_migrations table.
+            upgrade: The coroutine applying the migration.
+            transactional: Whether the migration runs in a transaction. Online index builds can't.
+        """
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        self.transactional = transactional
+
+    def __repr__(self):
+        return f"<Migration(version={self.version}, name={self.name})>"
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, name: str, transactional: bool = True) -> Callable[[Upgrade], Upgrade]:
+    """Registers the decorated coroutine as migration"""
+
+    def decorator(upgrade: Upgrade) -> Upgrade:
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Migration version {version} is used twice")
+        MIGRATIONS.append(Migration(version, name, upgrade, transactional))
+        return upgrade
+
+    return decorator
+
+
+async def create_index(conn: AsyncConnection, index: Index) -> None:
+    """
+    Creates an index if it doesn't exist yet. On PostgreSQL the index is built concurrently, so the table stays
+    writable while it's built. This requires a connection outside a transaction, see ``Migration.transactional``.
+    """
+    statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    if conn.dialect.name == "postgresql":
+        statement = statement.replace("INDEX", "INDEX CONCURRENTLY", 1)
+    await conn.exec_driver_sql(statement)
+
+
+async def migrate(engine: AsyncEngine, logger: CustomLogger) -> int:
+    """
+    Applies all pending migrations.
+
+    Args:
+        engine: The engine of the database. The schema_migrations table has to exist.
+        logger: The logger the applied migrations and their duration are logged to.
+
+    Returns: The amount of applied migrations.
+    """
+    async with engine.connect() as conn:
+        applied = set((await conn.execute(select(SchemaMigrations.version))).scalars())
+    pending = sorted((m for m in MIGRATIONS if m.version not in applied), key=lambda m: m.version)
+    if not pending:
+        logger.debug("Schema is up to date")
+        return 0
+    total = time.perf_counter()
+    for step in pending:
+        start = time.perf_counter()
+        async with engine.connect() as conn:
+            if not step.transactional:
+                await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await step.upgrade(conn)
+            duration = time.perf_counter() - start
+            await conn.execute(
+                insert(SchemaMigrations).values(
+                    version=step.version, name=step.name, applied_at=datetime.now(), duration=duration
+                )
+            )
+            await conn.commit()
+        logger.info(f"Applied migration {step.version:04d} ({step.name}) in {duration:.3f}s")
+    logger.info(f"Applied {len(pending)} migrations in {time.perf_counter() - total:.3f}s")
+    return len(pending)
+
+
+@migration(1, "index hot lookup columns", transactional=False)
+async def index_hot_lookup_columns(conn: AsyncConnection) -> None:
+    for model in (Settings, Infractions, Modmail, UserStats, Events, ConfirmationDB):
+        for index in model.__table__.indexes:
+            await create_index(conn, index)
+
+
+@migration(2, "backfill user totals")
+async def backfill_user_totals(conn: AsyncConnection) -> None:
+    totals: dict[tuple[int, int], dict[str, int]] = {}
+    for model in (UserStats, UserStatsRollup):
+        query = select(model.guild_id, model.user_id, model.stat_type, func.sum(model.value)).group_by(
+            model.guild_id, model.user_id, model.stat_type
+        )
+        for guild_id, user_id, stat_type, value in await conn.execute(query):
+            if stat_type in TOTAL_COLUMNS:
+                columns = totals.setdefault((guild_id, user_id), {})
+                columns[TOTAL_COLUMNS[stat_type]] = columns.get(TOTAL_COLUMNS[stat_type], 0) + (value or 0)
+    query = select(Infractions.guild, Infractions.user_id, func.count()).group_by(
+        Infractions.guild, Infractions.user_id
+    )
+    for guild_id, user_id, count in await conn.execute(query):
+        totals.setdefault((guild_id, user_id), {})["infractions"] = count
+    await conn.execute(delete(UserTotals))
+    columns = (*TOTAL_COLUMNS.values(), "infractions")
+    rows = [
+        {"guild_id": guild_id, "user_id": user_id, **{column: values.get(column, 0) for column in columns}}
+        for (guild_id, user_id), values in totals.items()
+    ]
+    for i in range(0, len(rows), 500):
+        await conn.execute(insert(UserTotals), rows[i : i + 500])
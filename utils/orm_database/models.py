@@ -1,10 +1,41 @@
 from datetime import date
 
-from sqlalchemy import Boolean, Column, DateTime, Integer, String, Date, UniqueConstraint, BigInteger, ForeignKey
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Integer,
+    String,
+    Date,
+    UniqueConstraint,
+    BigInteger,
+    ForeignKey,
+    Index,
+    Float,
+)
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
 
-__all__ = ["Base", "Settings", "Infractions", "Join2Create", "Modmail", "UserStats", "BotStatus", "EnabledCommands"]
+from ..enums import StatTypeEnum
+
+__all__ = [
+    "Base",
+    "Settings",
+    "Infractions",
+    "Join2Create",
+    "Modmail",
+    "UserStats",
+    "UserStatsRollup",
+    "UserTotals",
+    "LeaderboardEntry",
+    "BotStatus",
+    "EnabledCommands",
+    "Events",
+    "ConfirmationDB",
+    "Webhooks",
+    "DomainRules",
+    "SchemaMigrations",
+]
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -17,6 +48,11 @@ class Settings(Base):
     value = Column(Integer, primary_key=True)
     guild = Column(Integer, primary_key=True)
 
+    __table_args__ = (
+        # The primary key starts with (setting, value) and doesn't help lookups of a setting in a guild
+        Index("ix_settings_setting_guild", "setting", "guild"),
+    )
+
     def __repr__(self):
         return f"<Settings(setting='{self.setting}', value={self.value}, guild={self.guild})>"
 
@@ -33,6 +69,8 @@ class Infractions(Base):
     date = Column(DateTime)
     guild = Column(Integer)
 
+    __table_args__ = (Index("ix_infractions_user_guild", "user_id", "guild"),)
+
     def __repr__(self):
         return f"<Infractions(id={self.case_id}, user_id={self.user_id}, infraction={self.infraction}, reason={self.reason}, date={self.date}, guild={self.guild})>"
 
@@ -58,6 +96,8 @@ class Modmail(Base):
     uuid = Column(String, primary_key=True)
     anon = Column(Boolean)
 
+    __table_args__ = (Index("ix_modmail_user_id", "user_id"),)
+
     def __repr__(self):
         return f"<Modmail(user_id={self.user_id}, guild_id={self.guild_id}, uuid={self.uuid}, anon={self.anon})>"
 
@@ -74,12 +114,74 @@ class UserStats(Base):
     __table_args__ = (
         # Prevents duplicate entries for the same day and user
         UniqueConstraint("user_id", "guild_id", "stat_type", "day", name="_user_guild_stat_day_uc"),
+        # Lookups of a whole guild, the unique constraint only covers lookups starting with the user
+        Index("ix_userstats_guild_stat_day", "guild_id", "stat_type", "day"),
     )
 
     def __repr__(self):
         return f"<UserStats(user_id={self.user_id}, stat_type={self.stat_type}, value={self.value}, guild={self.guild_id})>"
 
 
+class UserStatsRollup(Base):
+    """Sums of the userstats rows that are older than the compaction horizon, see ``ORMDataBase.compact_user_stats``"""
+
+    __tablename__ = "userstats_rollup"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, nullable=False)
+    guild_id = Column(BigInteger, nullable=False)
+    stat_type = Column(String, nullable=False)
+    period = Column(String, nullable=False)  # StatPeriodEnum
+    period_start = Column(Date, nullable=False)  # monday of the week, first of the month or date.min for all time
+    value = Column(BigInteger, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "guild_id", "stat_type", "period", "period_start", name="_user_guild_stat_period_uc"
+        ),
+    )
+
+    def __repr__(self):
+        return f"<UserStatsRollup(user_id={self.user_id}, stat_type={self.stat_type}, period={self.period}, period_start={self.period_start}, value={self.value}, guild={self.guild_id})>"
+
+
+TOTAL_COLUMNS = {  # stat type -> column of the usertotals table
+    StatTypeEnum.VoiceTime.value: "voice_time",
+    StatTypeEnum.MessagesSent.value: "messages_sent",
+    StatTypeEnum.CommandsUsed.value: "commands_used",
+}
+
+
+class UserTotals(Base):
+    """All time totals per guild and user, maintained by the stat and infraction write paths"""
+
+    __tablename__ = "usertotals"
+    guild_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    voice_time = Column(BigInteger, nullable=False, default=0)
+    messages_sent = Column(BigInteger, nullable=False, default=0)
+    commands_used = Column(BigInteger, nullable=False, default=0)
+    infractions = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<UserTotals(user_id={self.user_id}, guild={self.guild_id}, voice_time={self.voice_time}, messages_sent={self.messages_sent}, commands_used={self.commands_used}, infractions={self.infractions})>"
+
+
+class LeaderboardEntry(Base):
+    """The persisted state of the in-memory leaderboards, see ``utils/orm_database/leaderboard.py``"""
+
+    __tablename__ = "leaderboard"
+    guild_id = Column(BigInteger, primary_key=True)
+    stat_type = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)  # StatPeriodEnum
+    rank = Column(Integer, primary_key=True)
+    period_start = Column(Date, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    value = Column(BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<LeaderboardEntry(guild={self.guild_id}, stat_type={self.stat_type}, period={self.period}, rank={self.rank}, user_id={self.user_id}, value={self.value})>"
+
+
 class BotStatus(Base):
     __tablename__ = "botstatus"
     id = Column(Integer, autoincrement=True, primary_key=True)
@@ -112,6 +214,11 @@ class Events(Base):
     time = Column(DateTime(timezone=True))
     mode = Column(String)
 
+    __table_args__ = (
+        Index("ix_events_host", "host"),
+        Index("ix_events_time", "time"),
+    )
+
     def __repr__(self):
         return f"<{self.__tablename__}(id={self.id}, host={self.host}, name={self.name}, time={self.time}, mode={self.mode})>"
 
@@ -123,5 +230,41 @@ class ConfirmationDB(Base):
     confirmation = Column(Boolean, nullable=True)
     reminders = Column(String)
 
+    __table_args__ = (Index("ix_confirmation_user_id", "user_id"),)
+
     def __repr__(self):
         return f"<{self.__tablename__}(event_id={self.event_id}, user_id={self.user_id}, confirmation={self.confirmation}, reminders={self.reminders})>"
+
+
+class Webhooks(Base):
+    __tablename__ = "webhooks"
+    channel_id = Column(BigInteger, primary_key=True)
+    guild_id = Column(BigInteger, nullable=False)
+    webhook_id = Column(BigInteger, nullable=False)
+    token = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f"<Webhooks(channel_id={self.channel_id}, guild_id={self.guild_id}, webhook_id={self.webhook_id})>"
+
+
+class DomainRules(Base):
+    """The domain allow and deny lists of the url filter, guild_id 0 holds the global lists"""
+
+    __tablename__ = "domainrules"
+    guild_id = Column(BigInteger, primary_key=True)
+    domain = Column(String, primary_key=True)
+    allowed = Column(Boolean, nullable=False)  # False for a denied domain
+
+    def __repr__(self):
+        return f"<DomainRules(guild_id={self.guild_id}, domain={self.domain}, allowed={self.allowed})>"
+
+
+class SchemaMigrations(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, nullable=False)
+    duration = Column(Float, nullable=False)  # seconds
+
+    def __repr__(self):
+        return f"<SchemaMigrations(version={self.version}, name={self.name}, applied_at={self.applied_at})>"
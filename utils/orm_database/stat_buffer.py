@@ -0,0 +1,95 @@
+import asyncio
+from datetime import date
+from typing import TYPE_CHECKING
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..enums import StatTypeEnum
+
+if TYPE_CHECKING:
+    from .database import ORMDataBase
+
+StatKey = tuple[int, int, str, date]  # (guild_id, user_id, stat_type, day)
+
+
+class UserStatBuffer:
+    """
+    Write-behind buffer for the userstats table. Increments are summed up in memory per
+    (guild_id, user_id, stat_type, day) and written to the database in one transaction.
+    """
+
+    def __init__(self, db: "ORMDataBase", max_size: int):
+        """
+        Args:
+            db: The database the buffered stats are written to.
+            max_size: The amount of distinct rows after which the buffer is flushed early.
+        """
+        self.db = db
+        self.max_size = max_size
+        self._pending: dict[StatKey, int] = {}
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def add(
+        self, guild_id: int, user_id: int, stat_type: StatTypeEnum, value: int, day: date | None = None
+    ) -> None:
+        """
+        Adds an increment to the buffer. Flushes the buffer if it reached its maximum size.
+        Args:
+            guild_id: The guild the stat belongs to.
+            user_id: The user the stat belongs to.
+            stat_type: The type of the stat.
+            value: The value to add.
+            day: The day the stat is counted for. Defaults to today.
+
+        Returns: None
+        """
+        self.put(guild_id, user_id, stat_type, value, day)
+        if len(self._pending) >= self.max_size:
+            await self.flush()
+
+    def put(self, guild_id: int, user_id: int, stat_type: StatTypeEnum, value: int, day: date | None = None) -> None:
+        """Adds an increment to the buffer without flushing it, for callers that can't await. See ``add``"""
+        key = (guild_id, user_id, stat_type.value, day or date.today())
+        self._pending[key] = self._pending.get(key, 0) + value
+
+    async def discard(self, stat_type: StatTypeEnum, user_id: int | None = None, guild_id: int | None = None) -> int:
+        """
+        Drops the buffered increments of a stat type, optionally only of a user and/or guild. Waits for a running flush
+        first, so nothing of the stat is written after this returns.
+
+        Returns: The amount of dropped rows.
+        """
+        async with self._lock:
+            dropped = [
+                key
+                for key in self._pending
+                if key[2] == stat_type.value
+                and (user_id is None or key[1] == user_id)
+                and (guild_id is None or key[0] == guild_id)
+            ]
+            for key in dropped:
+                del self._pending[key]
+            return len(dropped)
+
+    async def flush(self) -> int:
+        """
+        Writes all buffered increments to the database. If the write fails the increments are kept for the next flush.
+
+        Returns: The amount of rows written.
+        """
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            try:
+                await self.db.update_user_stats(pending)
+            except SQLAlchemyError as e:
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + value
+                self.db.logger.error(f"Couldn't flush {len(pending)} user stats, retrying next flush", exc_info=e)
+                return 0
+            self.db.logger.debug(f"Flushed {len(pending)} user stats")
+            return len(pending)
@@ -0,0 +1,317 @@
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import time
+from bisect import bisect_left
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .logger import CustomLogger
+
+THREAT_TYPES = ("MALWARE", "SOCIAL_ENGINEERING", "POTENTIALLY_HARMFUL_APPLICATION")
+PLATFORM_TYPE = "ANY_PLATFORM"
+THREAT_ENTRY_TYPE = "URL"
+
+
+def url_expressions(url: str) -> list[str]:
+    """
+    Returns the host suffix / path prefix expressions of a canonical url, as described by the safe browsing api.
+    Up to 5 hosts (the exact host and suffixes of its last 5 components) are combined with up to 6 paths (the exact
+    path with and without query and up to 4 directory prefixes).
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    path = parts.path or "/"
+    hosts = [host]
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        labels = host.split(".")
+        for i in range(max(0, len(labels) - 5), len(labels) - 1):
+            suffix = ".".join(labels[i:])
+            if suffix != host:
+                hosts.append(suffix)
+    paths = [f"{path}?{parts.query}"] if parts.query else []
+    paths.append(path)
+    prefix = "/"
+    prefixes = [prefix]
+    for directory in path.split("/")[1:-1][:3]:
+        prefix += directory + "/"
+        prefixes.append(prefix)
+    paths.extend(prefix for prefix in prefixes if prefix not in paths)
+    return [host + path for host in hosts[:5] for path in paths[:6]]
+
+
+def url_hashes(url: str) -> list[bytes]:
+    """Returns the SHA-256 hashes of the expressions of a canonical url"""
+    return [hashlib.sha256(expression.encode()).digest() for expression in url_expressions(url)]
+
+
+class SortedPrefixes:
+    """A read-only view on a file of sorted hash prefixes of the same size, memory mapped and searched in place"""
+
+    def __init__(self, path: Path, size: int):
+        self.size = size
+        self._file = open(path, "rb")  # noqa: SIM115, stays open as long as the file is mapped
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if path.stat().st_size else b""
+
+    def __len__(self):
+        return len(self._buffer) // self.size
+
+    def __getitem__(self, index: int) -> bytes:
+        return self._buffer[index * self.size : (index + 1) * self.size]
+
+    def __contains__(self, prefix: bytes) -> bool:
+        index = bisect_left(self, prefix)
+        return index < len(self) and self[index] == prefix
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._file.close()
+
+
+class ThreatList:
+    """The local copy of one threat list: its client state and its prefixes, one file per prefix size"""
+
+    def __init__(self, directory: Path, threat_type: str):
+        self.directory = directory
+        self.threat_type = threat_type
+        self.state = ""
+        self.prefixes: dict[int, SortedPrefixes] = {}
+
+    @property
+    def meta_path(self) -> Path:
+        return self.directory / f"{self.threat_type}.json"
+
+    def prefix_path(self, size: int) -> Path:
+        return self.directory / f"{self.threat_type}.{size}.bin"
+
+    def load(self) -> bool:
+        """
+        Maps the files of the last update, if there are any. An incomplete or unreadable copy is reset, so the next
+        update is a full update.
+
+        Returns: False if the local copy had to be reset.
+        """
+        self.close()
+        if not self.meta_path.exists():
+            return True
+        try:
+            meta = json.loads(self.meta_path.read_text())
+            for size in meta["sizes"]:
+                self.prefixes[size] = SortedPrefixes(self.prefix_path(size), size)
+            self.state = meta["state"]
+        except (OSError, ValueError, KeyError):
+            self.reset()
+            return False
+        return True
+
+    def __len__(self):
+        return sum(len(prefixes) for prefixes in self.prefixes.values())
+
+    def hits(self, full_hash: bytes) -> list[bytes]:
+        """Returns the prefixes of the list the full hash starts with"""
+        return [full_hash[:size] for size, prefixes in self.prefixes.items() if full_hash[:size] in prefixes]
+
+    def apply(self, update: dict) -> int:
+        """
+        Applies a list update response and writes the new prefix files. Blocking, runs in a thread.
+        Removal indices refer to the lexicographically sorted prefixes of all sizes before the update. The result is
+        verified with the checksum of the response; on a mismatch nothing is written and a ValueError is raised.
+
+        Returns: The amount of prefixes after the update.
+        """
+        if update.get("responseType") == "FULL_UPDATE":
+            current = []
+        else:
+            current = sorted(prefix for prefixes in self.prefixes.values() for prefix in prefixes)
+        removed = {index for removal in update.get("removals", []) for index in removal["rawIndices"]["indices"]}
+        if removed:
+            current = [prefix for index, prefix in enumerate(current) if index not in removed]
+        for addition in update.get("additions", []):
+            raw = base64.b64decode(addition["rawHashes"]["rawHashes"])
+            size = addition["rawHashes"]["prefixSize"]
+            current.extend(raw[i : i + size] for i in range(0, len(raw), size))
+        current.sort()
+        checksum = base64.b64decode(update.get("checksum", {}).get("sha256", ""))
+        if checksum and hashlib.sha256(b"".join(current)).digest() != checksum:
+            raise ValueError(f"Checksum mismatch for {self.threat_type}")
+        by_size: dict[int, list[bytes]] = {}
+        for prefix in current:
+            by_size.setdefault(len(prefix), []).append(prefix)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for size, prefixes in by_size.items():
+            tmp = self.prefix_path(size).with_suffix(".tmp")
+            tmp.write_bytes(b"".join(prefixes))
+            os.replace(tmp, self.prefix_path(size))
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"state": update["newClientState"], "sizes": sorted(by_size)}))
+        os.replace(tmp, self.meta_path)
+        return len(current)
+
+    def reset(self) -> None:
+        """Drops the local copy, the next update is a full update"""
+        self.close()
+        self.meta_path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        for prefixes in self.prefixes.values():
+            prefixes.close()
+        self.prefixes = {}
+        self.state = ""
+
+
+class SafeBrowsingDB:
+    """
+    A local threat database following the safe browsing update api. The hash prefixes of the threat lists are kept in
+    sorted, memory mapped files and updated with diffs. A url is only sent to the api (``fullHashes:find``) if one of
+    its hashes matches a local prefix, every other url is cleared locally.
+    """
+
+    def __init__(self, directory: Path, base_url: str, api_key: str, client_version: str, logger: CustomLogger):
+        """
+        Args:
+            directory: The directory the threat lists are stored in.
+            base_url: The base url of the api, e.g. ``https://safebrowsing.googleapis.com/v4``.
+            api_key: The api key sent with every request.
+            client_version: The version of the bot, sent as client version.
+            logger: The logger of the cog using the database.
+        """
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.client = {"clientId": "private", "clientVersion": client_version}
+        self.logger = logger
+        self.session: aiohttp.ClientSession = None  # type: ignore
+        self.lists = {threat_type: ThreatList(directory, threat_type) for threat_type in THREAT_TYPES}
+        self.next_update = 0.0  # monotonic time the api allows the next update at
+        self.next_lookup = 0.0  # monotonic time the api allows the next full hash request at
+
+    @property
+    def ready(self) -> bool:
+        """Whether every list was downloaded at least once"""
+        return all(threat_list.state for threat_list in self.lists.values())
+
+    def load(self, session: aiohttp.ClientSession) -> None:
+        self.session = session
+        for name, threat_list in self.lists.items():
+            if not threat_list.load():
+                self.logger.warning(
+                    f"The local copy of {name} is incomplete, it is downloaded again with the next update"
+                )
+        self.logger.info(f"Loaded the local threat lists: {self.info()}")
+
+    def info(self) -> str:
+        return ", ".join(f"{name}: {len(threat_list)} prefixes" for name, threat_list in self.lists.items())
+
+    async def _post(self, method: str, data: dict) -> dict:
+        async with self.session.post(f"{self.base_url}/{method}?key={self.api_key}", json=data) as request:
+            response = await request.json()
+            if request.status != 200:
+                raise aiohttp.ClientResponseError(
+                    request.request_info, request.history, status=request.status, message=str(response)
+                )
+            return response
+
+    async def update(self) -> bool:
+        """
+        Fetches the diffs of all lists and applies them. Lists whose checksum doesn't match are reset and fetched
+        completely with the next update.
+
+        Returns: Whether an update was made, False if the api asked to wait longer.
+        """
+        if time.monotonic() < self.next_update:
+            return False
+        data = {
+            "client": self.client,
+            "listUpdateRequests": [
+                {
+                    "threatType": name,
+                    "platformType": PLATFORM_TYPE,
+                    "threatEntryType": THREAT_ENTRY_TYPE,
+                    "state": threat_list.state,
+                    "constraints": {"supportedCompressions": ["RAW"]},
+                }
+                for name, threat_list in self.lists.items()
+            ],
+        }
+        response = await self._post("threatListUpdates:fetch", data)
+        self.next_update = time.monotonic() + float(response.get("minimumWaitDuration", "0s").rstrip("s"))
+        start = time.perf_counter()
+        for update in response.get("listUpdateResponses", []):
+            threat_list = self.lists.get(update["threatType"])
+            if threat_list is None:
+                continue
+            try:
+                await asyncio.to_thread(threat_list.apply, update)
+            except (ValueError, KeyError) as e:  # a checksum mismatch or a malformed response, binascii.Error included
+                self.logger.error(f"{e!r}, the list is downloaded again with the next update")
+                threat_list.reset()
+                continue
+            if not threat_list.load():  # maps the new files, lookups run on the loop so none of them uses the old ones
+                self.logger.error(f"Couldn't load the updated {threat_list.threat_type}, it is downloaded again")
+        self.logger.info(f"Updated the local threat lists in {time.perf_counter() - start:.2f}s: {self.info()}")
+        return True
+
+    def prefix_hits(self, url: str) -> tuple[list[bytes], set[bytes]]:
+        """Returns the full hashes of a canonical url and the local prefixes they matched"""
+        hashes = url_hashes(url)
+        hits = {prefix for full_hash in hashes for t in self.lists.values() for prefix in t.hits(full_hash)}
+        return hashes, hits
+
+    async def lookup(self, urls: list[str]) -> dict[str, bool]:
+        """
+        Returns whether each of the canonical urls is unsafe. Urls without a local prefix hit are safe without any
+        request; the others are confirmed with one ``fullHashes:find`` request. Urls that couldn't be confirmed are
+        left out.
+        """
+        verdicts = {}
+        candidates: dict[str, list[bytes]] = {}
+        prefixes: set[bytes] = set()
+        for url in urls:
+            hashes, hits = self.prefix_hits(url)
+            if hits:
+                candidates[url] = hashes
+                prefixes |= hits
+            else:
+                verdicts[url] = False
+        if not candidates:
+            return verdicts
+        if time.monotonic() < self.next_lookup:
+            return verdicts  # the api asked to back off, the candidates stay unknown
+        data = {
+            "client": self.client,
+            "clientStates": [threat_list.state for threat_list in self.lists.values()],
+            "threatInfo": {
+                "threatTypes": list(self.lists),
+                "platformTypes": [PLATFORM_TYPE],
+                "threatEntryTypes": [THREAT_ENTRY_TYPE],
+                "threatEntries": [{"hash": base64.b64encode(prefix).decode()} for prefix in sorted(prefixes)],
+            },
+        }
+        try:
+            response = await self._post("fullHashes:find", data)
+        except aiohttp.ClientError as e:
+            self.logger.error(f"Couldn't confirm {len(prefixes)} prefix hits", exc_info=e)
+            return verdicts
+        if "minimumWaitDuration" in response:
+            self.next_lookup = time.monotonic() + float(response["minimumWaitDuration"].rstrip("s"))
+        matched = {base64.b64decode(match["threat"]["hash"]) for match in response.get("matches", [])}
+        for url, hashes in candidates.items():
+            verdicts[url] = any(full_hash in matched for full_hash in hashes)
+        self.logger.debug(f"Confirmed {len(prefixes)} prefix hits, {len(matched)} full hashes matched")
+        return verdicts
+
+    def close(self) -> None:
+        for threat_list in self.lists.values():
+            threat_list.close()
@@ -0,0 +1,31 @@
+from config import (
+    SQLITE_BUSY_TIMEOUT,
+    SQLITE_CACHE_SIZE,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_SIZE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_TEMP_STORE,
+)
+
+# applied in this order on every new connection, journal_mode has to be set outside a transaction
+SQLITE_PRAGMAS: dict[str, str | int] = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": SQLITE_SYNCHRONOUS,
+    "cache_size": SQLITE_CACHE_SIZE,
+    "mmap_size": SQLITE_MMAP_SIZE,
+    "temp_store": SQLITE_TEMP_STORE,
+    "busy_timeout": SQLITE_BUSY_TIMEOUT,
+}
+
+
+def pragma_statements() -> list[str]:
+    """Returns the PRAGMA statements of the configured connection profile"""
+    return [f"PRAGMA {name} = {value}" for name, value in SQLITE_PRAGMAS.items()]
+
+
+def apply_pragmas(dbapi_connection, _connection_record=None):
+    """Applies the connection profile to a DBAPI connection. Used as SQLAlchemy ``connect`` event listener"""
+    cursor = dbapi_connection.cursor()
+    for statement in pragma_statements():
+        cursor.execute(statement)
+    cursor.close()
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+from .logger import CustomLogger
+
+
+class VerdictCache:
+    """
+    A bounded LRU cache of canonical url -> verdict of the safe browsing api. Safe and unsafe verdicts expire after
+    their own time to live, a safe url is asked again sooner than a known malicious one.
+    """
+
+    def __init__(self, max_size: int, safe_ttl: int, unsafe_ttl: int):
+        """
+        Args:
+            max_size: The amount of verdicts after which the least recently used one is dropped.
+            safe_ttl: The seconds a safe verdict is valid.
+            unsafe_ttl: The seconds an unsafe verdict is valid.
+        """
+        self.max_size = max_size
+        self.safe_ttl = safe_ttl
+        self.unsafe_ttl = unsafe_ttl
+        self._verdicts: OrderedDict[str, tuple[bool, float]] = OrderedDict()  # url -> (unsafe, expires as unix time)
+        self.hits = 0
+        self.misses = 0
+        self.saved_requests = 0  # api requests that weren't made because every url of a message was cached
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def get(self, url: str) -> bool | None:
+        """Returns whether the canonical url is unsafe, or None if there is no valid verdict"""
+        verdict = self._verdicts.get(url)
+        if verdict is None or verdict[1] <= time.time():
+            if verdict is not None:
+                del self._verdicts[url]
+            self.misses += 1
+            return None
+        self._verdicts.move_to_end(url)
+        self.hits += 1
+        return verdict[0]
+
+    def set(self, url: str, unsafe: bool, expires: float | None = None) -> float:
+        """
+        Stores the verdict of a canonical url.
+        Args:
+            url: The canonical url.
+            unsafe: Whether the safe browsing api matched the url.
+            expires: The unix time the verdict expires at. Defaults to now plus the time to live of the verdict.
+
+        Returns: The unix time the verdict expires at.
+        """
+        if expires is None:
+            expires = time.time() + (self.unsafe_ttl if unsafe else self.safe_ttl)
+        self._verdicts[url] = (unsafe, expires)
+        self._verdicts.move_to_end(url)
+        while len(self._verdicts) > self.max_size:
+            self._verdicts.popitem(last=False)
+        return expires
+
+    def info(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), {self.saved_requests} requests saved, "
+            f"{len(self)}/{self.max_size} verdicts"
+        )
+
+
+class LookupBatcher:
+    """
+    Collects the urls of all concurrent callers for ``window`` seconds, or until ``max_size`` urls are waiting, and
+    checks them with one call of ``lookup``. Every url is looked up once per batch, no matter how many callers wait
+    for it.
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[list[str]], Awaitable[dict[str, bool]]],
+        window: float,
+        max_size: int,
+        logger: CustomLogger,
+    ):
+        """
+        Args:
+            lookup: Returns whether each of the given urls is unsafe. Urls it leaves out stay unknown.
+            window: The seconds a batch is collected after its first url.
+            max_size: The amount of urls after which a batch is checked right away.
+            logger: The logger failed lookups are logged to.
+        """
+        self.lookup = lookup
+        self.window = window
+        self.max_size = max_size
+        self.logger = logger
+        self._pending: dict[str, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.batched_urls = 0
+
+    async def check(self, urls: list[str]) -> dict[str, bool]:
+        """Waits for the batches the urls end up in and returns the verdicts of the urls that could be checked"""
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for url in urls:
+            future = self._pending.get(url)
+            if future is None:
+                future = self._pending[url] = loop.create_future()
+            futures[url] = future
+            if len(self._pending) >= self.max_size:
+                self._dispatch()
+        if self._pending and self._timer is None:
+            self._timer = loop.call_later(self.window, self._dispatch)
+        # shielded, the futures are shared with other messages and a cancelled caller must not cancel their verdicts
+        results = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+        return {url: unsafe for url, unsafe in zip(futures, results) if unsafe is not None}
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)  # keeps a reference until the task is done
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: dict[str, asyncio.Future]) -> None:
+        self.batches += 1
+        self.batched_urls += len(batch)
+        try:
+            found = await self.lookup(list(batch))
+        except Exception as e:
+            self.logger.error(f"Couldn't check a batch of {len(batch)} urls", exc_info=e)
+            found = {}
+        for url, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(url))
@@ -0,0 +1,153 @@
+import re
+import socket
+from urllib.parse import unquote
+
+URL_PATTERN = re.compile(
+    r"(?:https?|ftp)://[^\s<>\"'`|]+"  # anything after a scheme
+    r"|(?:[\w-]+\.)+[a-z][\w-]+(?::\d+)?(?:[/?#][^\s<>\"'`|]*)?"  # a domain without scheme
+    r"|\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?(?:[/?#][^\s<>\"'`|]*)?",  # an ip address without scheme
+    re.IGNORECASE,
+)
+SCHEME = re.compile(r"^([a-z][a-z0-9+.-]*)://", re.IGNORECASE)
+IP_LIKE = re.compile(r"^(?:0x[0-9a-f]+|[0-9]+)(?:\.(?:0x[0-9a-f]+|[0-9]+)){0,3}$", re.IGNORECASE)
+# a cheap search that has to match before the full pattern runs: a dot followed by a tld-like label or an ip address
+CANDIDATE = re.compile(r"\.[a-z][\w-]|\d\.\d+\.\d+\.\d", re.IGNORECASE)
+TRAILING = ".,;:!?)]}*_~"  # punctuation and markdown that ends a sentence rather than the url
+BRACKETS = {")": "(", "]": "[", "}": "{"}
+UNSAFE = re.compile(r"[^\x21-\x7e]|[#%]")  # the characters that are escaped again after canonicalization
+PARTS = re.compile(r"([^/?]*)([^?]*)(\?.*)?", re.DOTALL)  # authority, path and query with its "?"
+LINE_BREAKS = re.compile(r"[\t\r\n]")
+DOTS = re.compile(r"\.{2,}")
+SLASHES = re.compile(r"/{2,}")
+
+
+def _unescape(value: str) -> str:
+    """Percent-unescapes until nothing changes anymore"""
+    while "%" in value:
+        unescaped = unquote(value, errors="surrogateescape")
+        if unescaped == value:
+            return value
+        value = unescaped
+    return value
+
+
+def _escape(value: str) -> str:
+    """Percent-escapes every character <= ASCII 32, >= 127, "#" and "%" with uppercase hex"""
+    if UNSAFE.search(value) is None:
+        return value  # most urls are plain ASCII already
+    escaped = []
+    for byte in value.encode("utf-8", errors="surrogateescape"):
+        if byte <= 32 or byte >= 127 or byte in (0x23, 0x25):
+            escaped.append(f"%{byte:02X}")
+        else:
+            escaped.append(chr(byte))
+    return "".join(escaped)
+
+
+def _canonical_host(host: str) -> str:
+    host = DOTS.sub(".", host.strip(".")).lower()
+    if host[-1:].isdigit() and IP_LIKE.match(host):
+        try:
+            return socket.inet_ntoa(socket.inet_aton(host))  # also resolves decimal, octal and hex notations
+        except OSError:
+            pass
+    return host
+
+
+def _canonical_path(path: str) -> str:
+    if "/." not in path and "//" not in path:
+        return path  # nothing to resolve
+    segments: list[str] = []
+    for segment in SLASHES.sub("/", path).split("/")[1:]:
+        if segment == "..":
+            if segments:
+                segments.pop()
+        elif segment != ".":
+            segments.append(segment)
+    canonical = "/" + "/".join(segments)
+    if path.endswith(("/.", "/..")) and not canonical.endswith("/"):
+        canonical += "/"
+    return canonical
+
+
+def _strip_trailing(url: str) -> str:
+    """
+    Strips trailing punctuation. A closing bracket is only stripped if it has no opening partner in the url,
+    "https://de.wikipedia.org/wiki/Foo_(Bar)" keeps its bracket, "(see https://example.com)" doesn't.
+    """
+    while url and url[-1] in TRAILING:
+        opening = BRACKETS.get(url[-1])
+        if opening is not None and url.count(opening) >= url.count(url[-1]):
+            break
+        url = url[:-1]
+    return url
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonicalizes a url as described by the safe browsing api: tabs and line breaks are removed, as well as the
+    fragment, user info and port. The url is unescaped repeatedly, dots of the host are collapsed and an ip address in
+    any notation is written as dotted decimal. "/./", "/../" and repeated slashes of the path are resolved. Finally
+    control characters, non-ASCII characters, "#" and "%" are escaped again.
+    """
+    url = LINE_BREAKS.sub("", url.strip())
+    match = SCHEME.match(url)
+    if match:
+        scheme, rest = match.group(1).lower(), url[match.end() :]
+    else:
+        scheme, rest = "http", url
+    authority, path, query = PARTS.match(_unescape(rest.split("#", 1)[0])).groups()  # type: ignore
+    host = authority.rsplit("@", 1)[-1]
+    if not host.startswith("["):  # an IPv6 address keeps its colons
+        host = host.split(":", 1)[0]
+    return _escape(f"{scheme}://{_canonical_host(host)}{_canonical_path(path or '/')}{query or ''}")
+
+
+def extract_urls(content: str) -> list[str]:
+    """
+    Returns the canonical urls of a message, without duplicates and in the order they appear. Urls that only differ
+    in their scheme are duplicates, the first one is kept.
+    Most messages can't contain a url, they are rejected by a substring check and ``CANDIDATE`` before the full
+    pattern runs.
+    """
+    if "." not in content or CANDIDATE.search(content) is None:
+        return []
+    urls: dict[str, str] = {}  # url without scheme -> url, the lists match host and path only
+    for match in URL_PATTERN.finditer(content):
+        url = _strip_trailing(match.group())
+        if url:
+            url = canonicalize_url(url)
+            urls.setdefault(url.split("://", 1)[1], url)
+    return list(urls.values())
+
+
+if __name__ == "__main__":
+    # Benchmark of the extraction over a corpus of chat messages, one message per line:
+    # python -m utils.urls [assets/chat_corpus.txt]
+    import sys
+    import timeit
+    from pathlib import Path
+    from urllib.parse import urlsplit, urlunsplit
+
+    corpus = Path(sys.argv[1] if len(sys.argv) > 1 else "assets/chat_corpus.txt").read_text().splitlines()
+    old_pattern = r"(?:(?:https?|ftp):\/\/)?[\w/\-?=%.]+\.[\w/\-&?=%.]+"  # the pattern used before
+
+    def old_canonicalize(url: str) -> str:
+        url = url.strip() if "://" in url else "http://" + url.strip()
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower().rstrip("."), parts.path or "/", parts.query, ""))
+
+    def old_extract(message: str) -> list[str]:
+        matches = re.finditer(old_pattern, message, re.MULTILINE)
+        return list(dict.fromkeys(old_canonicalize(match.group()) for match in matches))
+
+    with_urls = [message for message in corpus if extract_urls(message)]
+    without_urls = [message for message in corpus if not extract_urls(message)]
+    print(f"{len(corpus)} messages, {len(with_urls)} with urls")
+    for name, extract in (("before", old_extract), ("after", extract_urls)):
+        timings = []
+        for messages in (corpus, without_urls, with_urls):
+            best = min(timeit.repeat(lambda: [extract(m) for m in messages], number=20, repeat=5))  # noqa: B023
+            timings.append(f"{best / 20 / len(messages) * 1e6:.2f}µs")
+        lookups = sum(len(extract(message)) for message in corpus)
+        print(f"{name:<7} {timings[0]} per message ({timings[1]} without, {timings[2]} with urls), {lookups} lookups")